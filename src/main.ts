@@ -24,7 +24,6 @@ import {
 } from './noclip/gfx/platform/GfxPlatformWebGL2.js';
 import { AntialiasingMode } from './noclip/gfx/helpers/RenderGraphHelpers.js';
 import { parseAVTpl } from './noclip/SuperMonkeyBall/AVTpl.js';
-import { decompressLZ } from './noclip/SuperMonkeyBall/AVLZ.js';
 import * as Nl from './noclip/SuperMonkeyBall/NaomiLib.js';
 import * as Gma from './noclip/SuperMonkeyBall/Gma.js';
 import { GameplaySyncState, Renderer } from './noclip/Render.js';
@@ -40,7 +39,7 @@ import type {
   RoomMeta,
   ChatMessage,
 } from './netcode_protocol.js';
-import { parseStagedefLz } from './noclip/SuperMonkeyBall/Stagedef.js';
+import { parseStagedefLz, parseStagedefUncompressed } from './noclip/SuperMonkeyBall/Stagedef.js';
 import { StageId, STAGE_INFO_MAP } from './noclip/SuperMonkeyBall/StageInfo.js';
 import type { StageData } from './noclip/SuperMonkeyBall/World.js';
 import { convertSmb2StageDef, getMb2wsStageInfo, getSmb2StageInfo } from './smb2_render.js';
@@ -48,7 +47,10 @@ import { HudRenderer } from './hud.js';
 import type { ReplayData } from './replay.js';
 import {
   fetchPackSlice,
+  decompressPackLz,
+  isPackLzStoredRaw,
   prefetchPackSlice,
+  prefetchPackStageBundle,
   getActivePack,
   getPackCourseData,
   getPackStageBasePath,
@@ -452,23 +454,25 @@ async function loadRenderStage(stageId: number): Promise<StageData> {
       stageNlTplPath ? fetchSlice(stageNlTplPath) : Promise.resolve(null),
     ]);
 
-  const stagedef = parseStagedefLz(stagedefBuf);
+  const stagedef = isPackLzStoredRaw(stagedefPath)
+    ? parseStagedefUncompressed(stagedefBuf)
+    : parseStagedefLz(stagedefBuf);
 
   const stageTpl = parseAVTpl(stageTplBuf, `st${stageIdStr}`);
   const stageGma = Gma.parseGma(stageGmaBuf, stageTpl);
 
   const commonTpl = parseAVTpl(commonTplBuf, 'common');
   const commonGma = Gma.parseGma(commonGmaBuf, commonTpl);
-  const commonNlTpl = parseAVTpl(decompressLZ(commonNlTplBuf), 'common-nl');
-  const nlObj = Nl.parseObj(decompressLZ(commonNlBuf), commonNlTpl);
+  const commonNlTpl = parseAVTpl(decompressPackLz(commonNlTplPath, commonNlTplBuf), 'common-nl');
+  const nlObj = Nl.parseObj(decompressPackLz(commonNlPath, commonNlBuf), commonNlTpl);
 
   const bgTpl = parseAVTpl(bgTplBuf, bgName);
   const bgGma = Gma.parseGma(bgGmaBuf, bgTpl);
   let stageNlObj: Nl.Obj | null = null;
   let stageNlObjNameMap: Map<string, number> | null = null;
-  if (stageNlObjBuf && stageNlTplBuf) {
-    const nlTpl = parseAVTpl(decompressLZ(stageNlTplBuf), `st${stageIdStr}-nl`);
-    const nlObjBuffer = decompressLZ(stageNlObjBuf);
+  if (stageNlObjPath && stageNlTplPath && stageNlObjBuf && stageNlTplBuf) {
+    const nlTpl = parseAVTpl(decompressPackLz(stageNlTplPath, stageNlTplBuf), `st${stageIdStr}-nl`);
+    const nlObjBuffer = decompressPackLz(stageNlObjPath, stageNlObjBuf);
     stageNlObj = Nl.parseObj(nlObjBuffer, nlTpl);
     stageNlObjNameMap = Nl.buildObjNameMap(nlObjBuffer);
   }
@@ -534,8 +538,8 @@ async function loadRenderStageSmb2(stageId: number, stage: any, gameSource: Game
 
   const commonTpl = parseAVTpl(commonTplBuf, 'common');
   const commonGma = Gma.parseGma(commonGmaBuf, commonTpl);
-  const commonNlTpl = parseAVTpl(decompressLZ(commonNlTplBuf), 'common-nl');
-  const nlObj = Nl.parseObj(decompressLZ(commonNlBuf), commonNlTpl);
+  const commonNlTpl = parseAVTpl(decompressPackLz(commonNlTplPath, commonNlTplBuf), 'common-nl');
+  const nlObj = Nl.parseObj(decompressPackLz(commonNlPath, commonNlBuf), commonNlTpl);
 
   const bgGma = bgName
     ? Gma.parseGma(bgGmaBuf, parseAVTpl(bgTplBuf, bgName))
@@ -3205,7 +3209,13 @@ function preloadNextStages() {
         ? getStageAssetPathsSmb1(stageId, stageBasePath)
         : getStageAssetPathsSmb2(stageId, activeGameSource, stageBasePath);
     if (paths.length > 0) {
-      queuePrefetch(paths);
+      // Files the stage's bundle held are served from cache by the time these run.
+      const bundle = prefetchPackStageBundle(stageId, activeGameSource);
+      if (bundle) {
+        void bundle.then(() => queuePrefetch(paths));
+      } else {
+        queuePrefetch(paths);
+      }
     }
   }
 }
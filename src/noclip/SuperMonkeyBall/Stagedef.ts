@@ -497,7 +497,7 @@ function parseBgModelList(buffer: ArrayBufferSlice, offset: number): BgObject[]
     return bgObjects;
 }
 
-function parseStagedefUncompressed(buffer: ArrayBufferSlice): Stage {
+export function parseStagedefUncompressed(buffer: ArrayBufferSlice): Stage {
     const view = buffer.createDataView();
 
     const loopStartSeconds = view.getInt32(0x0);
@@ -1,5 +1,6 @@
-import { unzipSync } from 'fflate';
+import { inflateSync, unzipSync } from 'fflate';
 import ArrayBufferSlice from './noclip/ArrayBufferSlice.js';
+import { decompressLZ } from './noclip/SuperMonkeyBall/AVLZ.js';
 import { STAGE_BASE_PATHS, type GameSource } from './constants.js';
 
 export type PackKeyframe = {
@@ -10,6 +11,16 @@ export type PackKeyframe = {
   out?: number;
 };
 
+// Columnar keyframe track (manifest `keyframeEncoding: 'columnar'`): parallel arrays, one entry per keyframe.
+// `parsePackManifest` turns these back into `PackKeyframe[]` when a pack is loaded.
+export type PackKeyframeColumns = {
+  t: number[];
+  v: number[];
+  ease?: number[];
+  in?: number[];
+  out?: number[];
+};
+
 export type PackFogAnim = {
   start?: PackKeyframe[] | null;
   end?: PackKeyframe[] | null;
@@ -62,6 +73,36 @@ export type PackManifest = {
   };
   courses?: PackCourseData;
   stageEnv?: Record<string, PackStageEnv>;
+  // `.lz` files (stagedefs, NL objects) are stored already decompressed.
+  lzDecompressed?: boolean;
+  blobStore?: PackBlobStore;
+  bundles?: PackBundle[];
+  files?: Record<string, PackFileInfo>;
+  // Sizes of the .gz/.br sidecars written next to these files, for servers.
+  precompressed?: Record<string, { gz?: number; br?: number }>;
+  keyframeEncoding?: 'objects' | 'columnar';
+};
+
+// Byte size and SHA-256 of a pack file; `decompressedSize` is set for LZSS `.lz` files.
+export type PackFileInfo = {
+  size: number;
+  sha256: string;
+  decompressedSize?: number;
+};
+
+// Files of a run of consecutive course stages concatenated into one file;
+// `files` maps each pack path to its [offset, size] within the bundle.
+export type PackBundle = {
+  path: string;
+  stages: number[];
+  files: Record<string, [number, number]>;
+};
+
+// Content-addressed layout: `files` maps pack paths to blobs under `base`,
+// which is relative to the pack folder and may be shared with other packs.
+export type PackBlobStore = {
+  base: string;
+  files: Record<string, string>;
 };
 
 export type PackProvider = {
@@ -72,6 +113,9 @@ export type LoadedPack = {
   manifest: PackManifest;
   provider: PackProvider;
   basePath: string;
+  // Only URL-backed packs can reach the shared blob store; local folders, zips
+  // and containers hold every file under its logical path.
+  useBlobStore?: boolean;
 };
 
 let activePack: LoadedPack | null = null;
@@ -80,6 +124,7 @@ const urlSliceCache = new Map<string, ArrayBufferSlice>();
 const urlSliceInFlight = new Map<string, Promise<ArrayBufferSlice>>();
 const packSliceCache = new WeakMap<LoadedPack, Map<string, ArrayBufferSlice>>();
 const packSliceInFlight = new WeakMap<LoadedPack, Map<string, Promise<ArrayBufferSlice>>>();
+const packBundleRequests = new WeakMap<LoadedPack, Map<string, Promise<void>>>();
 
 function getPackSliceCache(pack: LoadedPack) {
   let cache = packSliceCache.get(pack);
@@ -126,6 +171,36 @@ async function fetchWithCache(
   return promise;
 }
 
+function keyframesFromColumns(columns: PackKeyframeColumns): PackKeyframe[] {
+  return columns.t.map((t, i) => ({
+    ease: columns.ease?.[i] ?? 0,
+    t,
+    v: columns.v[i],
+    in: columns.in?.[i] ?? 0,
+    out: columns.out?.[i] ?? 0,
+  }));
+}
+
+function parsePackManifest(text: string): PackManifest {
+  const manifest = JSON.parse(text) as PackManifest;
+  if (manifest.keyframeEncoding !== 'columnar') {
+    return manifest;
+  }
+  for (const env of Object.values(manifest.stageEnv ?? {})) {
+    const anim = env.fog?.anim as Record<string, PackKeyframe[] | PackKeyframeColumns | null> | undefined;
+    if (!anim) {
+      continue;
+    }
+    for (const [key, track] of Object.entries(anim)) {
+      if (track && !Array.isArray(track)) {
+        anim[key] = keyframesFromColumns(track);
+      }
+    }
+  }
+  manifest.keyframeEncoding = 'objects';
+  return manifest;
+}
+
 function normalizePackPath(path: string): string {
   return path.replace(/^\.\//, '').replace(/^\//, '');
 }
@@ -145,6 +220,26 @@ function joinBasePath(basePath: string, path: string): string {
   return `${normalizedBase}/${normalized}`;
 }
 
+function resolvePackBlobPath(pack: LoadedPack, resolved: string): string {
+  const store = pack.manifest.blobStore;
+  if (!store || !pack.useBlobStore) {
+    return resolved;
+  }
+  const normalizedBase = pack.basePath.replace(/\/+$/, '');
+  const logical = normalizedBase && resolved.startsWith(`${normalizedBase}/`)
+    ? resolved.slice(normalizedBase.length + 1)
+    : resolved;
+  const blob = store.files[logical];
+  if (!blob) {
+    return resolved;
+  }
+  return joinBasePath(pack.basePath, `${store.base.replace(/\/+$/, '')}/${blob}`);
+}
+
+function resolvePackPath(pack: LoadedPack, path: string): string {
+  return resolvePackBlobPath(pack, joinBasePath(pack.basePath, normalizePackPath(path)));
+}
+
 export function setActivePack(pack: LoadedPack | null) {
   activePack = pack;
 }
@@ -211,11 +306,26 @@ export function hasPackForGameSource(gameSource: GameSource): boolean {
   return !!packEnabled && activePack?.manifest.gameSource === gameSource;
 }
 
+function isDefaultContentPath(normalized: string): boolean {
+  const defaultBasePaths = Object.values(STAGE_BASE_PATHS).map((base) => normalizePackPath(base));
+  return defaultBasePaths.some((base) => normalized === base || normalized.startsWith(`${base}/`));
+}
+
+// True when `path` is served by the active pack and holds decompressed `.lz` data.
+export function isPackLzStoredRaw(path: string): boolean {
+  const normalized = normalizePackPath(path);
+  return !!activePack?.manifest.lzDecompressed && normalized.endsWith('.lz') && !isDefaultContentPath(normalized);
+}
+
+// decompressLZ for data fetched from `path`, unless the pack stored it decompressed.
+export function decompressPackLz(path: string, buffer: ArrayBufferSlice): ArrayBufferSlice {
+  return isPackLzStoredRaw(path) ? buffer : decompressLZ(buffer);
+}
+
 export async function fetchPackSlice(path: string): Promise<ArrayBufferSlice> {
   const pack = activePack;
   const normalized = normalizePackPath(path);
-  const defaultBasePaths = Object.values(STAGE_BASE_PATHS).map((base) => normalizePackPath(base));
-  const isDefaultPath = defaultBasePaths.some((base) => normalized === base || normalized.startsWith(`${base}/`));
+  const isDefaultPath = isDefaultContentPath(normalized);
   if (pack && isDefaultPath) {
     const cacheKey = normalizePackPath(path);
     return fetchWithCache(cacheKey, urlSliceCache, urlSliceInFlight, async () => {
@@ -236,7 +346,7 @@ export async function fetchPackSlice(path: string): Promise<ArrayBufferSlice> {
       return new ArrayBufferSlice(await response.arrayBuffer());
     });
   }
-  const resolved = joinBasePath(pack.basePath, normalized);
+  const resolved = resolvePackPath(pack, normalized);
   const cacheKey = normalizePackPath(resolved);
   const cache = getPackSliceCache(pack);
   const inflight = getPackSliceInFlight(pack);
@@ -251,12 +361,66 @@ export async function prefetchPackSlice(path: string): Promise<void> {
   }
 }
 
+// Fetches the bundle holding `stageId` (the one where it comes earliest, so the
+// most following stages are warmed) and seeds the slice cache with its files.
+// Returns null when the active pack has no bundle for the stage.
+export function prefetchPackStageBundle(stageId: number, gameSource: GameSource): Promise<void> | null {
+  const pack = activePack;
+  if (!pack || !packEnabled || pack.manifest.gameSource !== gameSource || !pack.manifest.bundles) {
+    return null;
+  }
+  let requests = packBundleRequests.get(pack);
+  if (!requests) {
+    requests = new Map();
+    packBundleRequests.set(pack, requests);
+  }
+  let best: PackBundle | null = null;
+  let bestIndex = Infinity;
+  for (const bundle of pack.manifest.bundles) {
+    const index = bundle.stages.indexOf(stageId);
+    if (index < 0) {
+      continue;
+    }
+    const pending = requests.get(bundle.path);
+    if (pending) {
+      return pending;
+    }
+    if (index < bestIndex) {
+      best = bundle;
+      bestIndex = index;
+    }
+  }
+  if (!best) {
+    return null;
+  }
+  const bundle = best;
+  const promise = (async () => {
+    try {
+      const slice = new ArrayBufferSlice(await pack.provider.fetch(resolvePackPath(pack, bundle.path)));
+      const cache = getPackSliceCache(pack);
+      for (const [path, [offset, size]] of Object.entries(bundle.files)) {
+        const cacheKey = normalizePackPath(resolvePackPath(pack, path));
+        if (!cache.has(cacheKey)) {
+          cache.set(cacheKey, slice.subarray(offset, size));
+        }
+      }
+    } catch (err) {
+      console.warn(`Prefetch failed for bundle ${bundle.path}.`, err);
+    }
+  })();
+  requests.set(bundle.path, promise);
+  return promise;
+}
+
 export async function fetchPackBuffer(path: string): Promise<ArrayBuffer> {
   const slice = await fetchPackSlice(path);
   return slice.arrayBuffer.slice(slice.byteOffset, slice.byteOffset + slice.byteLength);
 }
 
 export async function loadPackFromUrl(url: string): Promise<LoadedPack> {
+  if (url.endsWith(PACK_CONTAINER_SUFFIX)) {
+    return loadPackFromContainer(createUrlRangeReader(url), '');
+  }
   if (url.endsWith('.zip')) {
     const response = await fetch(url);
     if (!response.ok) {
@@ -272,7 +436,7 @@ export async function loadPackFromUrl(url: string): Promise<LoadedPack> {
   if (!response.ok) {
     throw new Error(`Failed to load pack.json: ${response.status} ${response.statusText}`);
   }
-  const manifest = await response.json();
+  const manifest = parsePackManifest(await response.text());
   const provider: PackProvider = {
     fetch: async (path: string) => {
       const res = await fetch(path);
@@ -282,10 +446,13 @@ export async function loadPackFromUrl(url: string): Promise<LoadedPack> {
       return res.arrayBuffer();
     },
   };
-  return { manifest, provider, basePath: manifest.basePath ?? basePath };
+  return { manifest, provider, basePath: manifest.basePath ?? basePath, useBlobStore: true };
 }
 
 export async function loadPackFromZipFile(file: File): Promise<LoadedPack> {
+  if (file.name.endsWith(PACK_CONTAINER_SUFFIX)) {
+    return loadPackFromContainer((start, end) => file.slice(start, end).arrayBuffer(), '');
+  }
   const buffer = await file.arrayBuffer();
   return loadPackFromZipBuffer(buffer, '');
 }
@@ -302,7 +469,7 @@ export async function loadPackFromFileList(fileList: FileList): Promise<LoadedPa
   if (!manifestFile) {
     throw new Error('pack.json not found in selected folder');
   }
-  const manifest = JSON.parse(await manifestFile.text()) as PackManifest;
+  const manifest = parsePackManifest(await manifestFile.text());
   const provider: PackProvider = {
     fetch: async (path: string) => {
       const normalized = normalizePackPath(path);
@@ -326,7 +493,7 @@ function loadPackFromZipBuffer(buffer: ArrayBuffer, basePath: string): LoadedPac
   if (!manifestBytes) {
     throw new Error('pack.json not found in zip');
   }
-  const manifest = JSON.parse(new TextDecoder('utf-8').decode(manifestBytes)) as PackManifest;
+  const manifest = parsePackManifest(new TextDecoder('utf-8').decode(manifestBytes));
   const provider: PackProvider = {
     fetch: async (path: string) => {
       const normalized = normalizePackPath(path);
@@ -339,3 +506,119 @@ function loadPackFromZipBuffer(buffer: ArrayBuffer, basePath: string): LoadedPac
   };
   return { manifest, provider, basePath };
 }
+
+// Range-readable pack container written by `smb2_pack_builder.py --container`.
+// Little-endian header (magic, version, count, index size), then one index
+// entry per member (u64 offset, u32 stored size, u32 size, u32 crc32,
+// u8 method, pad, u16 name length, name), then independently compressed
+// members. Only the index and the members actually requested are fetched.
+const PACK_CONTAINER_SUFFIX = '.smbpack';
+const PACK_CONTAINER_MAGIC = 'SMBPACK\0';
+const PACK_CONTAINER_VERSION = 1;
+const PACK_CONTAINER_HEADER_SIZE = 20;
+const PACK_CONTAINER_ENTRY_SIZE = 24;
+const PACK_CONTAINER_INDEX_PROBE = 64 * 1024;
+const PACK_CONTAINER_DEFLATED = 1;
+
+type PackContainerEntry = {
+  offset: number;
+  storedSize: number;
+  size: number;
+  method: number;
+};
+
+// Reads bytes [start, end) of a container; may return fewer past the end of the file.
+type PackRangeReader = (start: number, end: number) => Promise<ArrayBuffer>;
+
+function createUrlRangeReader(url: string): PackRangeReader {
+  let whole: Promise<ArrayBuffer> | null = null;
+  return async (start, end) => {
+    if (!whole) {
+      const response = await fetch(url, { headers: { Range: `bytes=${start}-${end - 1}` } });
+      if (!response.ok) {
+        throw new Error(`Failed to load ${url}: ${response.status} ${response.statusText}`);
+      }
+      if (response.status === 206) {
+        return response.arrayBuffer();
+      }
+      // The server ignored the Range header and sent everything; keep it for later reads.
+      whole ??= response.arrayBuffer();
+    }
+    return (await whole).slice(start, end);
+  };
+}
+
+async function readPackContainerIndex(read: PackRangeReader): Promise<Map<string, PackContainerEntry>> {
+  let head = await read(0, PACK_CONTAINER_INDEX_PROBE);
+  if (head.byteLength < PACK_CONTAINER_HEADER_SIZE) {
+    throw new Error('Truncated pack container header');
+  }
+  let view = new DataView(head);
+  const magic = new TextDecoder('latin1').decode(new Uint8Array(head, 0, 8));
+  if (magic !== PACK_CONTAINER_MAGIC) {
+    throw new Error('Not a pack container');
+  }
+  const version = view.getUint32(8, true);
+  if (version !== PACK_CONTAINER_VERSION) {
+    throw new Error(`Unsupported pack container version ${version}`);
+  }
+  const count = view.getUint32(12, true);
+  const indexEnd = PACK_CONTAINER_HEADER_SIZE + view.getUint32(16, true);
+  if (head.byteLength < indexEnd) {
+    const rest = await read(head.byteLength, indexEnd);
+    const joined = new Uint8Array(head.byteLength + rest.byteLength);
+    joined.set(new Uint8Array(head), 0);
+    joined.set(new Uint8Array(rest), head.byteLength);
+    head = joined.buffer;
+    view = new DataView(head);
+  }
+  if (head.byteLength < indexEnd) {
+    throw new Error('Truncated pack container index');
+  }
+  const decoder = new TextDecoder('utf-8');
+  const entries = new Map<string, PackContainerEntry>();
+  let pos = PACK_CONTAINER_HEADER_SIZE;
+  for (let i = 0; i < count; i++) {
+    const entry = {
+      offset: Number(view.getBigUint64(pos, true)),
+      storedSize: view.getUint32(pos + 8, true),
+      size: view.getUint32(pos + 12, true),
+      method: view.getUint8(pos + 20),
+    };
+    const nameLength = view.getUint16(pos + 22, true);
+    pos += PACK_CONTAINER_ENTRY_SIZE;
+    entries.set(normalizePackPath(decoder.decode(new Uint8Array(head, pos, nameLength))), entry);
+    pos += nameLength;
+  }
+  return entries;
+}
+
+async function readPackContainerEntry(read: PackRangeReader, entry: PackContainerEntry): Promise<ArrayBuffer> {
+  const stored = await read(entry.offset, entry.offset + entry.storedSize);
+  if (entry.method !== PACK_CONTAINER_DEFLATED) {
+    return stored;
+  }
+  const data = inflateSync(new Uint8Array(stored), { out: new Uint8Array(entry.size) });
+  return data.buffer.slice(data.byteOffset, data.byteOffset + data.byteLength);
+}
+
+async function loadPackFromContainer(read: PackRangeReader, basePath: string): Promise<LoadedPack> {
+  const entries = await readPackContainerIndex(read);
+  const manifestEntry = entries.get('pack.json');
+  if (!manifestEntry) {
+    throw new Error('pack.json not found in pack container');
+  }
+  const manifestBytes = await readPackContainerEntry(read, manifestEntry);
+  const manifest = parsePackManifest(new TextDecoder('utf-8').decode(manifestBytes));
+  const provider: PackProvider = {
+    fetch: async (path: string) => {
+      const normalized = normalizePackPath(path);
+      const entry = entries.get(normalized);
+      if (!entry) {
+        throw new Error(`Missing pack entry: ${normalized}`);
+      }
+      return readPackContainerEntry(read, entry);
+    },
+  };
+  return { manifest, provider, basePath };
+}
@@ -1,9 +1,8 @@
 import { lzssDecompress } from './lzs.js';
-import { fetchPackBuffer } from './pack.js';
+import { decompressPackLz, fetchPackBuffer, isPackLzStoredRaw } from './pack.js';
 import ArrayBufferSlice from './noclip/ArrayBufferSlice.js';
 import { CommonNlModelID } from './noclip/SuperMonkeyBall/NlModelInfo.js';
 import { parseObj as parseNlObj } from './noclip/SuperMonkeyBall/NaomiLib.js';
-import { decompressLZ } from './noclip/SuperMonkeyBall/AVLZ.js';
 import {
   BUMPER_BOUND_CENTER,
   BUMPER_BOUND_RADIUS,
@@ -3751,8 +3750,8 @@ export async function loadGoalTapeAnchorY(basePath = STAGE_BASE_PATHS.smb1, game
   } catch {
     return null;
   }
-  const tplSlice = decompressLZ(new ArrayBufferSlice(tplBuffer));
-  const nlSlice = decompressLZ(new ArrayBufferSlice(nlBuffer));
+  const tplSlice = decompressPackLz(commonNlTplPath, new ArrayBufferSlice(tplBuffer));
+  const nlSlice = decompressPackLz(commonNlPath, new ArrayBufferSlice(nlBuffer));
   if (!tplSlice.byteLength || !nlSlice.byteLength) {
     return null;
   }
@@ -3772,7 +3771,7 @@ export async function loadStageDef(stageId, basePath = STAGE_BASE_PATHS.smb1, ga
   const id = formatStageId(stageId);
   const path = `${basePath}/st${id}/STAGE${id}.lz`;
   const buffer = await fetchPackBuffer(path);
-  const decompressed = lzssDecompress(buffer);
+  const decompressed = isPackLzStoredRaw(path) ? new Uint8Array(buffer) : lzssDecompress(buffer);
   const view = new Uint8Array(decompressed.buffer, decompressed.byteOffset, decompressed.byteLength);
   const stage = parseStageDef(view, gameSource);
   stage.stageId = stageId;
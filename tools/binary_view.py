@@ -0,0 +1,118 @@
+"""Big-endian binary reading helpers shared by the SMB2 ROM tools."""
+
+from __future__ import annotations
+
+import struct
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+U8 = struct.Struct('>B')
+S8 = struct.Struct('>b')
+U16 = struct.Struct('>H')
+S16 = struct.Struct('>h')
+U32 = struct.Struct('>I')
+S32 = struct.Struct('>i')
+F32 = struct.Struct('>f')
+
+_STRUCT_CACHE: Dict[str, struct.Struct] = {}
+
+
+def get_struct(fmt: str) -> struct.Struct:
+    """Return a cached Struct for `fmt` (big-endian unless a byte order is given)."""
+    cached = _STRUCT_CACHE.get(fmt)
+    if cached is None:
+        full_fmt = fmt if fmt[:1] in ('<', '>', '!', '=', '@') else f'>{fmt}'
+        cached = struct.Struct(full_fmt)
+        _STRUCT_CACHE[fmt] = cached
+    return cached
+
+
+Buffer = Union[bytes, bytearray, memoryview, 'BinaryView']
+
+
+class BinaryView:
+    """Zero-copy big-endian reader over a byte buffer; release it before closing a wrapped mmap."""
+
+    __slots__ = ('view',)
+
+    def __init__(self, data: Buffer) -> None:
+        if isinstance(data, BinaryView):
+            data = data.view
+        view = memoryview(data)
+        if view.format != 'B' or view.ndim != 1:
+            view = view.cast('B')
+        self.view = view
+
+    @classmethod
+    def of(cls, data: Buffer) -> 'BinaryView':
+        return data if isinstance(data, BinaryView) else cls(data)
+
+    def __enter__(self) -> 'BinaryView':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.release()
+
+    def release(self) -> None:
+        self.view.release()
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def __getitem__(self, index):
+        return self.view[index]
+
+    def u8(self, offset: int) -> int:
+        return self.view[offset]
+
+    def s8(self, offset: int) -> int:
+        return S8.unpack_from(self.view, offset)[0]
+
+    def u16(self, offset: int) -> int:
+        return U16.unpack_from(self.view, offset)[0]
+
+    def s16(self, offset: int) -> int:
+        return S16.unpack_from(self.view, offset)[0]
+
+    def u32(self, offset: int) -> int:
+        return U32.unpack_from(self.view, offset)[0]
+
+    def s32(self, offset: int) -> int:
+        return S32.unpack_from(self.view, offset)[0]
+
+    def f32(self, offset: int) -> float:
+        return F32.unpack_from(self.view, offset)[0]
+
+    def unpack(self, fmt: str, offset: int) -> Tuple:
+        return get_struct(fmt).unpack_from(self.view, offset)
+
+    def records(self, fmt: str, offset: int, count: int) -> Iterator[Tuple]:
+        """Iterate `count` consecutive records of `fmt` starting at `offset`."""
+        record = get_struct(fmt)
+        end = offset + record.size * count
+        if offset < 0 or end > len(self.view):
+            raise struct.error(f'{count} records of {record.format!r} at {offset:#x} exceed buffer')
+        return record.iter_unpack(self.view[offset:end])
+
+    def columns(self, fmt: str, offset: int, count: int) -> Tuple[Tuple, ...]:
+        """Decode `count` consecutive records of `fmt`, returned column-wise."""
+        record = get_struct(fmt)
+        fields = len(record.unpack(bytes(record.size)))
+        if count <= 0:
+            return ((),) * fields
+        return tuple(zip(*self.records(fmt, offset, count)))
+
+    def array(self, fmt: str, offset: int, count: int) -> Tuple:
+        """Read `count` scalars of one type, e.g. array('h', off, 43)."""
+        return get_struct(f'{count}{fmt}').unpack_from(self.view, offset)
+
+    def ptr(self, offset: int, limit: Optional[int] = None) -> Optional[int]:
+        """Read a u32 offset; None when out of range, null, or past `limit`."""
+        if offset is None or offset < 0 or offset + 4 > len(self.view):
+            return None
+        value = U32.unpack_from(self.view, offset)[0]
+        if value == 0 or value >= (len(self.view) if limit is None else limit):
+            return None
+        return value
+
+    def tobytes(self) -> bytes:
+        return self.view.tobytes()
@@ -0,0 +1,134 @@
+"""Per-output-folder build journal used for incremental pack rebuilds."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+BUILD_JOURNAL_NAME = '.build-journal.json'
+BUILD_JOURNAL_VERSION = 1
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open('rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildJournal:
+    """Inputs, outputs and data of each unit of the last build of an output folder."""
+
+    def __init__(self, out_dir: Path, settings: Dict[str, object], reuse: bool = True) -> None:
+        self.out_dir = out_dir
+        self.path = out_dir / BUILD_JOURNAL_NAME
+        self.settings = settings
+        self.units: Dict[str, Dict[str, object]] = {}
+        self.changed = False
+        self._input_states: Dict[str, Optional[Dict[str, object]]] = {}
+        previous: Dict[str, object] = {}
+        try:
+            previous = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            pass
+        if not isinstance(previous, dict) or previous.get('version') != BUILD_JOURNAL_VERSION:
+            previous = {}
+        self._previous_units: Dict[str, Dict[str, object]] = previous.get('units') or {}
+        self._previous_inputs: Dict[str, Dict[str, object]] = {}
+        for unit in self._previous_units.values():
+            self._previous_inputs.update(unit.get('inputs') or {})
+        self._reuse = reuse and previous.get('settings') == settings
+
+    def input_state(self, path: Path) -> Optional[Dict[str, object]]:
+        key = str(path)
+        if key in self._input_states:
+            return self._input_states[key]
+        try:
+            stat = path.stat()
+        except OSError:
+            state = None
+        else:
+            state = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            known = self._previous_inputs.get(key)
+            if known and known.get('size') == stat.st_size and known.get('mtime_ns') == stat.st_mtime_ns:
+                state['sha256'] = known.get('sha256')
+            else:
+                state['sha256'] = hash_file(path)
+        self._input_states[key] = state
+        return state
+
+    def reuse(self, key: str, inputs: List[Path]) -> Optional[Dict[str, object]]:
+        """Return the stored data of `key` if nothing it depends on changed, else None."""
+        previous = self._previous_units.get(key) if self._reuse else None
+        if previous is None:
+            return None
+        states = {str(path): self.input_state(path) for path in inputs}
+        previous_inputs = previous.get('inputs') or {}
+        if states.keys() != previous_inputs.keys():
+            return None
+        for name, state in states.items():
+            # A missing input matches a previously missing one (its warning is in `data`).
+            if (state or {}).get('sha256') != (previous_inputs[name] or {}).get('sha256'):
+                return None
+        outputs = previous.get('outputs') or {}
+        for rel_path, size in outputs.items():
+            try:
+                if (self.out_dir / rel_path).stat().st_size != size:
+                    return None
+            except OSError:
+                return None
+        self.units[key] = {'inputs': states, 'outputs': outputs, 'data': previous.get('data')}
+        return previous.get('data') or {}
+
+    def record(
+        self,
+        key: str,
+        inputs: List[Path],
+        outputs: List[Path],
+        data: Optional[Dict[str, object]] = None,
+    ) -> None:
+        """Record a unit that was just (re)built; missing outputs are skipped."""
+        output_sizes: Dict[str, int] = {}
+        for path in outputs:
+            try:
+                output_sizes[path.relative_to(self.out_dir).as_posix()] = path.stat().st_size
+            except OSError:
+                continue
+        self.units[key] = {
+            'inputs': {str(path): self.input_state(path) for path in inputs},
+            'outputs': output_sizes,
+            'data': data,
+        }
+        self.changed = True
+
+    def finish(self) -> None:
+        """Delete outputs no unit produced this time and write the journal."""
+        current = {rel_path for unit in self.units.values() for rel_path in unit['outputs']}
+        for unit in self._previous_units.values():
+            for rel_path in unit.get('outputs') or {}:
+                if rel_path in current:
+                    continue
+                path = self.out_dir / rel_path
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                self.changed = True
+                if path.parent != self.out_dir:
+                    try:
+                        path.parent.rmdir()
+                    except OSError:
+                        pass
+        journal = {
+            'version': BUILD_JOURNAL_VERSION,
+            'settings': self.settings,
+            'units': self.units,
+        }
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(journal), encoding='utf-8')
+        os.replace(tmp_path, self.path)
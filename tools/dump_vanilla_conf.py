@@ -6,19 +6,33 @@ warning: bad
 """
 
 from pathlib import Path
-import struct
+from array import array
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import accumulate
+import glob
+import hashlib
 import logging
+import os
 import sys
 import json
-from typing import Dict, List, Optional, Set, Tuple
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from binary_view import BinaryView
+from rom_cache import default_rom_cache_dir, read_rom_entry, rel_fingerprint, write_rom_entry
+
+try:
+    import numpy as np
+except ImportError:  # Optional; the story table search falls back to a scalar scan.
+    np = None
 
 VANILLA_ROOT_PATH = Path(
     "/mnt/c/Users/ComplexPlane/Documents/projects/romhack/smb2imm/files"
 )
 
-CourseCommand = namedtuple("CourseCommand", ["opcode", "type", "value"])
-SmStageInfo = namedtuple("SmStageInfo", ["stage_id", "difficulty"])
+# Column-wise course command records: opcodes/types as bytes, values as array("I").
+CourseCommandTable = namedtuple("CourseCommandTable", ["opcodes", "types", "values"])
 
 # CMD opcodes
 CMD_IF = 0
@@ -38,6 +52,39 @@ THEN_END_COURSE = 2
 FLOOR_STAGE_ID = 0
 FLOOR_TIME = 1
 
+# Verified table offsets of known main_loop.rel builds: {"courses": {name:
+# [offset, cmd_count]}, "story": [world offsets]}; cmd_count None parses up to
+# CMD_COURSE_END. The vanilla offsets are tried (and validated against the stage
+# folder) before any scan; whatever validates is recorded in the shared ROM
+# cache (rom_cache.py) under the REL's sha256 and the stage folder, so later
+# runs skip both.
+KNOWN_ROM_TABLES: Dict[str, dict] = {
+    "vanilla": {
+        "courses": {
+            "beginner": [0x002075B0, None],
+            "advanced": [0x00207914, None],
+            "expert": [0x00208634, None],
+            "beginner_extra": [0x00209CF4, None],
+            "advanced_extra": [0x0020A0C8, None],
+            "expert_extra": [0x0020A448, None],
+            "master": [0x0020A8E0, None],
+            "master_extra": [0x0020ACB4, None],
+        },
+        "story": [0x0020B448 + i * 0x28 for i in range(10)],
+    },
+}
+ROM_CACHE_SECTION = "tables"
+
+# (opcode, type) pairs that continue a course command chain; CMD_COURSE_END ends it.
+CHAIN_COMMANDS = {
+    (CMD_IF, IF_FLOOR_CLEAR),
+    (CMD_IF, IF_GOAL_TYPE),
+    (CMD_THEN, THEN_JUMP_FLOOR),
+    (CMD_THEN, THEN_END_COURSE),
+    (CMD_FLOOR, FLOOR_STAGE_ID),
+    (CMD_FLOOR, FLOOR_TIME),
+}
+
 
 def get_theme_and_music_ids(stage_id, stage_id_to_theme_id, theme_id_to_music_id):
     if stage_id < 0 or stage_id >= len(stage_id_to_theme_id):
@@ -55,6 +102,31 @@ def get_theme_and_music_ids(stage_id, stage_id_to_theme_id, theme_id_to_music_id
     return (theme_id, music_id)
 
 
+def decode_course_commands(
+    mainloop_buffer, start, count=None, max_cmds=1024
+) -> CourseCommandTable:
+    """Decode a course command table into opcode/type/value columns.
+
+    Without `count`, the table runs through the first CMD_COURSE_END (or
+    `max_cmds` records / the end of the buffer), found from a strided slice of
+    the opcode bytes before the records are unpacked.
+    """
+    course_cmd_size = 0x1C
+    view = BinaryView.of(mainloop_buffer)
+    if count is None:
+        count = max(0, min(max_cmds, (len(view) - start) // course_cmd_size))
+        opcodes = view[start : start + count * course_cmd_size : course_cmd_size]
+        end = opcodes.tobytes().find(CMD_COURSE_END)
+        if end != -1:
+            count = end + 1
+    opcodes, types, values = bytearray(), bytearray(), array("I")
+    for opcode, cmd_type, value in view.records("BBxxI20x", start, count):
+        opcodes.append(opcode)
+        types.append(cmd_type)
+        values.append(value)
+    return CourseCommandTable(bytes(opcodes), bytes(types), values)
+
+
 def parse_cm_course(
     mainloop_buffer,
     stgname_lines,
@@ -72,33 +144,7 @@ def parse_cm_course(
             raise SystemExit(message)
         raise ValueError(message)
 
-    cmds: list[CourseCommand] = []
-    course_cmd_size = 0x1C
-
-    if count is None:
-        i = 0
-        while start + (i + 1) * course_cmd_size <= len(mainloop_buffer) and i < max_cmds:
-            course_cmd = CourseCommand._make(
-                struct.unpack_from(
-                    ">BBxxI20x",
-                    mainloop_buffer,
-                    start + i * course_cmd_size,
-                )
-            )
-            cmds.append(course_cmd)
-            if course_cmd.opcode == CMD_COURSE_END:
-                break
-            i += 1
-    else:
-        for i in range(count):
-            course_cmd = CourseCommand._make(
-                struct.unpack_from(
-                    ">BBxxI20x",
-                    mainloop_buffer,
-                    start + i * course_cmd_size,
-                )
-            )
-            cmds.append(course_cmd)
+    commands = decode_course_commands(mainloop_buffer, start, count, max_cmds)
 
     # Course commands to stage infos
     cm_stage_infos = []
@@ -111,9 +157,9 @@ def parse_cm_course(
     first = True
     finished = False
 
-    for cmd in cmds:
-        if cmd.opcode == CMD_FLOOR:
-            if cmd.type == FLOOR_STAGE_ID:
+    for opcode, cmd_type, value in zip(*commands):
+        if opcode == CMD_FLOOR:
+            if cmd_type == FLOOR_STAGE_ID:
                 if not first:
                     if blue_jump is None:
                         raise_error("Invalid blue goal jump")
@@ -151,48 +197,48 @@ def parse_cm_course(
                     red_jump = None
                     last_goal_type = None
 
-                stage_id = cmd.value
+                stage_id = value
                 first = False
 
-            elif cmd.type == FLOOR_TIME:
-                stage_time = cmd.value
+            elif cmd_type == FLOOR_TIME:
+                stage_time = value
             else:
-                raise_error(f"Invalid CMD_FLOOR opcode type: {cmd.type}")
+                raise_error(f"Invalid CMD_FLOOR opcode type: {cmd_type}")
 
-        elif cmd.opcode == CMD_IF:
-            if cmd.type == IF_FLOOR_CLEAR:
+        elif opcode == CMD_IF:
+            if cmd_type == IF_FLOOR_CLEAR:
                 last_goal_type = None
-            elif cmd.type == IF_GOAL_TYPE:
-                last_goal_type = cmd.value
+            elif cmd_type == IF_GOAL_TYPE:
+                last_goal_type = value
             else:
-                raise_error(f"Invalid CMD_IF opcode type: {cmd.type}")
+                raise_error(f"Invalid CMD_IF opcode type: {cmd_type}")
 
-        elif cmd.opcode == CMD_THEN:
-            if cmd.type == THEN_JUMP_FLOOR:
+        elif opcode == CMD_THEN:
+            if cmd_type == THEN_JUMP_FLOOR:
                 if last_goal_type is None:
                     if blue_jump is None:
-                        blue_jump = cmd.value
+                        blue_jump = value
                     if green_jump is None:
-                        green_jump = cmd.value
+                        green_jump = value
                     if red_jump is None:
-                        red_jump = cmd.value
+                        red_jump = value
                 elif last_goal_type == 0:
-                    blue_jump = cmd.value
+                    blue_jump = value
                 elif last_goal_type == 1:
-                    green_jump = cmd.value
+                    green_jump = value
                 elif last_goal_type == 2:
-                    red_jump = cmd.value
+                    red_jump = value
                 else:
                     raise_error(f"Invalid last goal type: {last_goal_type}")
-            elif cmd.type == THEN_END_COURSE:
+            elif cmd_type == THEN_END_COURSE:
                 # Jumps are irrelevant, this is end of difficulty
                 blue_jump = 1
                 green_jump = 1
                 red_jump = 1
             else:
-                raise_error(f"Invalid CMD_THEN opcode type: {cmd.type}")
+                raise_error(f"Invalid CMD_THEN opcode type: {cmd_type}")
 
-        elif cmd.opcode == CMD_COURSE_END:
+        elif opcode == CMD_COURSE_END:
             if blue_jump is None:
                 raise_error("Invalid blue goal jump")
             theme_id, music_id = get_theme_and_music_ids(
@@ -221,7 +267,7 @@ def parse_cm_course(
             finished = True
 
         else:
-            raise_error(f"Invalid opcode: {cmd.opcode}")
+            raise_error(f"Invalid opcode: {opcode}")
 
     if not finished:
         raise_error("Course command list ended early")
@@ -282,33 +328,25 @@ def dump_storymode_world_layout(
     theme_id_to_music_id_map,
     start,
 ):
-    stage_info_size = 0x4
-
-    stage_infos: list[SmStageInfo] = []
-    for i in range(10):
-        offs = start + i * stage_info_size
-        stage_info = SmStageInfo._make(struct.unpack_from(">hh", mainloop_buffer, offs))
-        stage_infos.append(stage_info)
-
     out_json_array = []
-    for stage_info in stage_infos:
-        time_limit = 60 * 60 if stage_info.stage_id != 30 else 60 * 30
+    for stage_id, difficulty in BinaryView.of(mainloop_buffer).records("hh", start, 10):
+        time_limit = 60 * 60 if stage_id != 30 else 60 * 30
         theme_id, music_id = get_theme_and_music_ids(
-            stage_info.stage_id, stage_id_to_theme_id_map, theme_id_to_music_id_map
+            stage_id, stage_id_to_theme_id_map, theme_id_to_music_id_map
         )
         stage_name = (
-            stgname_lines[stage_info.stage_id]
-            if 0 <= stage_info.stage_id < len(stgname_lines)
-            else f"Stage {stage_info.stage_id}"
+            stgname_lines[stage_id]
+            if 0 <= stage_id < len(stgname_lines)
+            else f"Stage {stage_id}"
         )
         out_json_array.append(
             {
-                "stage_id": stage_info.stage_id,
+                "stage_id": stage_id,
                 "name": stage_name,
                 "theme_id": theme_id,
                 "music_id": music_id,
                 "time_limit": float(time_limit / 60),
-                "difficulty": stage_info.difficulty,
+                "difficulty": difficulty,
             }
         )
 
@@ -415,58 +453,86 @@ def find_course_offsets(
     max_cmds: int = 512,
 ) -> List[Tuple[int, int]]:
     course_cmd_size = 0x1C
+    stride = course_cmd_size // 4
+    view = BinaryView.of(data)
+    data = view.view
     candidates: List[Tuple[int, int, float]] = []
-    for off in range(0, len(data) - course_cmd_size, 4):
-        opcode = data[off]
-        cmd_type = data[off + 1]
-        if opcode != CMD_FLOOR or cmd_type != FLOOR_STAGE_ID:
-            continue
-        stage_count = 0
-        valid_stage_count = 0
-        cmd_count = 0
-        finished = False
-        for i in range(max_cmds):
-            cmd_off = off + i * course_cmd_size
-            if cmd_off + course_cmd_size > len(data):
+
+    # Index j stands for the aligned offset 4 * j. Commands fit up to `last`, and
+    # a chain from j continues at j + stride, so chains on one stride share tails.
+    last = (len(data) - course_cmd_size) // 4
+    if last < 0:
+        return []
+    opcodes = data[0 : last * 4 + 1 : 4].tobytes()
+    cmd_types = data[1 : last * 4 + 2 : 4].tobytes()
+
+    # Every CMD_FLOOR/FLOOR_STAGE_ID command, decoded once: index -> stage id.
+    floor_stage_values: Dict[int, int] = {}
+    j = opcodes.find(CMD_FLOOR)
+    while j != -1:
+        if cmd_types[j] == FLOOR_STAGE_ID:
+            floor_stage_values[j] = view.u32(j * 4 + 4)
+        j = opcodes.find(CMD_FLOOR, j + 1)
+
+    # index -> (finished, cmd_count, stage_count, valid_stage_count) of the
+    # uncapped chain starting there; max_cmds is applied when scoring.
+    chains: Dict[int, Tuple[bool, int, int, int]] = {}
+
+    def walk(start: int) -> Tuple[bool, int, int, int]:
+        path = []
+        j = start
+        while True:
+            tail = chains.get(j)
+            if tail is not None:
                 break
-            opcode = data[cmd_off]
-            cmd_type = data[cmd_off + 1]
-            value = struct.unpack_from(">I", data, cmd_off + 4)[0]
-            cmd_count += 1
-            if opcode == CMD_FLOOR:
-                if cmd_type == FLOOR_STAGE_ID:
-                    stage_count += 1
-                    if value in stage_ids:
-                        valid_stage_count += 1
-                elif cmd_type != FLOOR_TIME:
-                    break
-            elif opcode == CMD_IF:
-                if cmd_type not in (IF_FLOOR_CLEAR, IF_GOAL_TYPE):
-                    break
-            elif opcode == CMD_THEN:
-                if cmd_type not in (THEN_JUMP_FLOOR, THEN_END_COURSE):
-                    break
-            elif opcode == CMD_COURSE_END:
-                finished = True
+            if j > last:
+                tail = (False, 0, 0, 0)
                 break
-            else:
+            opcode = opcodes[j]
+            if opcode == CMD_COURSE_END:
+                tail = chains[j] = (True, 1, 0, 0)
                 break
-        if not finished or stage_count < min_stages:
+            if (opcode, cmd_types[j]) not in CHAIN_COMMANDS:
+                tail = chains[j] = (False, 1, 0, 0)
+                break
+            path.append(j)
+            j += stride
+        for j in reversed(path):
+            finished, cmd_count, stage_count, valid_stage_count = tail
+            value = floor_stage_values.get(j)
+            if value is not None:
+                stage_count += 1
+                if value in stage_ids:
+                    valid_stage_count += 1
+            tail = chains[j] = (finished, cmd_count + 1, stage_count, valid_stage_count)
+        return tail
+
+    # Named stages are counted over max_cmds commands from the start, past the
+    # course end, so use prefix sums along each stride residue.
+    named_flags = bytearray(last + 1)
+    for j, value in floor_stage_values.items():
+        if value in named_stage_ids:
+            named_flags[j] = 1
+    named_prefix: Dict[int, List[int]] = {}
+
+    def count_named(start: int) -> int:
+        residue, pos = start % stride, start // stride
+        prefix = named_prefix.get(residue)
+        if prefix is None:
+            prefix = named_prefix[residue] = [0, *accumulate(named_flags[residue::stride])]
+        end = pos + min(max_cmds, (last - start) // stride + 1)
+        return prefix[end] - prefix[pos]
+
+    for j in sorted(floor_stage_values):
+        off = j * 4
+        if off >= len(data) - course_cmd_size:
+            break
+        finished, cmd_count, stage_count, valid_stage_count = walk(j)
+        if not finished or cmd_count > max_cmds or stage_count < min_stages:
             continue
         ratio = valid_stage_count / max(1, stage_count)
-        named_count = 0
         if named_stage_ids:
-            for i in range(max_cmds):
-                cmd_off = off + i * course_cmd_size
-                if cmd_off + course_cmd_size > len(data):
-                    break
-                opcode = data[cmd_off]
-                cmd_type = data[cmd_off + 1]
-                if opcode == CMD_FLOOR and cmd_type == FLOOR_STAGE_ID:
-                    value = struct.unpack_from(">I", data, cmd_off + 4)[0]
-                    if value in named_stage_ids:
-                        named_count += 1
-            named_ratio = named_count / max(1, stage_count)
+            named_ratio = count_named(j) / max(1, stage_count)
         else:
             named_ratio = 0.0
         score = stage_count * ratio - cmd_count * 0.05 + named_ratio
@@ -488,6 +554,45 @@ def find_course_offsets(
     return selected
 
 
+def sliding_window_sums(mask, window: int):
+    prefix = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return prefix[window:] - prefix[:-window]
+
+
+def story_window_offsets(
+    data: bytes,
+    start: int,
+    window_count: int,
+    window: int,
+    stage_ids: Set[int],
+    named_stage_ids: Set[int],
+    min_unique: int,
+) -> Iterator[int]:
+    """Yield offsets of `window`-entry story stage tables passing validation.
+
+    Windows start every 4 bytes from `start`; each entry is a big-endian
+    (stage_id, difficulty) int16 pair. All entries need a known stage id and
+    a difficulty in 0..5, at least `min_unique` distinct stage ids and, when
+    names are known, a 30% named-stage ratio. Decodes the whole span once and
+    slides over validity / named masks with prefix sums.
+    """
+    entries = np.frombuffer(
+        BinaryView.of(data).view,
+        dtype=">i2",
+        count=(window_count + window - 1) * 2,
+        offset=start,
+    )
+    ids, difficulties = entries[0::2], entries[1::2]
+    valid = np.isin(ids, list(stage_ids)) & (difficulties >= 0) & (difficulties <= 5)
+    ok = sliding_window_sums(valid, window) == window
+    if named_stage_ids:
+        named_sums = sliding_window_sums(np.isin(ids, list(named_stage_ids)), window)
+        ok &= ~(named_sums / max(1, window) < 0.3)
+    for idx in np.flatnonzero(ok):
+        if len(np.unique(ids[idx : idx + window])) >= min_unique:
+            yield start + int(idx) * 4
+
+
 def find_story_block_offset(
     data: bytes,
     stage_ids: Set[int],
@@ -497,13 +602,30 @@ def find_story_block_offset(
     world_count = 10
     stages_per_world = 10
     block_size = world_count * stages_per_world * entry_size
-    for off in range(0, len(data) - block_size, 4):
+    view = BinaryView.of(data)
+    if np is not None:
+        window_count = len(range(0, len(view) - block_size, 4))
+        if window_count <= 0:
+            return None
+        return next(
+            story_window_offsets(
+                view,
+                0,
+                window_count,
+                world_count * stages_per_world,
+                stage_ids,
+                named_stage_ids,
+                min_unique=20,
+            ),
+            None,
+        )
+    for off in range(0, len(view) - block_size, 4):
         valid = True
         unique_ids: Set[int] = set()
         named_count = 0
         for idx in range(world_count * stages_per_world):
             entry_off = off + idx * entry_size
-            stage_id, difficulty = struct.unpack_from(">hh", data, entry_off)
+            stage_id, difficulty = view.unpack("hh", entry_off)
             if stage_id not in stage_ids:
                 valid = False
                 break
@@ -528,10 +650,16 @@ def is_story_world_valid(
     stage_ids: Set[int],
     named_stage_ids: Set[int],
 ) -> bool:
+    view = BinaryView.of(data)
+    if np is not None and 0 <= offset and offset + 40 <= len(view):
+        windows = story_window_offsets(
+            view, offset, 1, 10, stage_ids, named_stage_ids, min_unique=3
+        )
+        return next(windows, None) is not None
     unique_ids: Set[int] = set()
     named_count = 0
     for idx in range(10):
-        stage_id, difficulty = struct.unpack_from(">hh", data, offset + idx * 4)
+        stage_id, difficulty = view.unpack("hh", offset + idx * 4)
         if stage_id not in stage_ids:
             return False
         if difficulty < 0 or difficulty > 5:
@@ -546,11 +674,65 @@ def is_story_world_valid(
     return True
 
 
+def stage_folder_key(stage_ids: Set[int], named_stage_ids: Set[int]) -> str:
+    # Validation depends on which stages exist and which are named.
+    signature = json.dumps([sorted(stage_ids), sorted(named_stage_ids)])
+    return hashlib.sha256(signature.encode("ascii")).hexdigest()
+
+
+def drop_log_record(record: logging.LogRecord) -> bool:
+    return False
+
+
+def record_rom_tables(registry_dir: Path, fingerprint: str, key: str, tables: dict) -> None:
+    error = write_rom_entry(fingerprint, ROM_CACHE_SECTION, tables, key, cache_dir=registry_dir)
+    if error:
+        logging.warning("%s", error)
+
+
+def load_registered_course_data(
+    mainloop_buffer,
+    stgname_lines,
+    bonus_stage_ids,
+    stage_id_to_theme_id_map,
+    theme_id_to_music_id_map,
+    tables: dict,
+) -> dict:
+    cm_layout: Dict[str, List[dict]] = {}
+    for name, (offset, cmd_count) in tables["courses"].items():
+        cm_layout[name] = parse_cm_course(
+            mainloop_buffer,
+            stgname_lines,
+            bonus_stage_ids,
+            stage_id_to_theme_id_map,
+            theme_id_to_music_id_map,
+            offset,
+            cmd_count,
+            strict=False,
+        )
+    worlds = [
+        dump_storymode_world_layout(
+            mainloop_buffer,
+            stgname_lines,
+            stage_id_to_theme_id_map,
+            theme_id_to_music_id_map,
+            offs,
+        )
+        for offs in tables["story"]
+    ]
+    return {
+        "challenge": cm_layout,
+        "story": worlds,
+    }
+
+
 def load_vanilla_course_data(
     rom_dir: Path,
     *,
     course_cmd_counts: Optional[Dict[str, int]] = None,
     world_offsets: Optional[List[int]] = None,
+    registry_dir: Optional[Path] = None,
+    use_registry: bool = True,
 ) -> dict:
     mainloop_path = rom_dir / "mkb2.main_loop.rel"
     stgname_path = rom_dir / "stgname" / "usa.str"
@@ -559,29 +741,97 @@ def load_vanilla_course_data(
     if not stgname_path.exists():
         raise FileNotFoundError(f"missing {stgname_path}")
 
-    mainloop_buffer = mainloop_path.read_bytes()
+    mainloop_buffer = BinaryView(mainloop_path.read_bytes())
     stgname_lines = stgname_path.read_text(encoding="ascii", errors="ignore").splitlines()
     named_stage_ids = {i for i, name in enumerate(stgname_lines) if name and name != "-"}
 
-    bonus_stage_ids = struct.unpack_from(">9i", mainloop_buffer, 0x00176118)
-    stage_id_to_theme_id_map = struct.unpack_from(">428B", mainloop_buffer, 0x00204E48)
-    theme_id_to_music_id_map = struct.unpack_from(">43h", mainloop_buffer, 0x0016E738)
+    bonus_stage_ids = mainloop_buffer.array("i", 0x00176118, 9)
+    stage_id_to_theme_id_map = mainloop_buffer.array("B", 0x00204E48, 428)
+    theme_id_to_music_id_map = mainloop_buffer.array("h", 0x0016E738, 43)
 
     stage_ids = list_stage_ids(rom_dir / "stage")
 
+    # Builds seen before with the same stage folder skip validation and
+    # scanning; the warnings of the run that cached them are replayed. Explicit
+    # counts / world offsets from the caller take precedence over the cache.
+    use_registry = use_registry and course_cmd_counts is None and world_offsets is None
+    if use_registry:
+        registry_dir = registry_dir or default_rom_cache_dir()
+        fingerprint = rel_fingerprint(mainloop_buffer.view)
+        key = stage_folder_key(stage_ids, named_stage_ids)
+        tables = read_rom_entry(fingerprint, ROM_CACHE_SECTION, key, cache_dir=registry_dir)
+        if isinstance(tables, dict):
+            # The recorded warnings already include those of parsing these tables.
+            root_logger = logging.getLogger()
+            root_logger.addFilter(drop_log_record)
+            try:
+                data = load_registered_course_data(
+                    mainloop_buffer,
+                    stgname_lines,
+                    bonus_stage_ids,
+                    stage_id_to_theme_id_map,
+                    theme_id_to_music_id_map,
+                    tables,
+                )
+            except Exception as exc:
+                data = None
+                error = exc
+            finally:
+                root_logger.removeFilter(drop_log_record)
+            if data is not None:
+                for message in tables.get("warnings", []):
+                    logging.warning("%s", message)
+                return data
+            logging.warning(
+                "Cached tables for %s failed to parse (%s); rescanning.", fingerprint, error
+            )
+
+    collector = WarningCollector()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(collector)
+    try:
+        data, tables = locate_course_data(
+            mainloop_buffer,
+            stgname_lines,
+            bonus_stage_ids,
+            stage_id_to_theme_id_map,
+            theme_id_to_music_id_map,
+            stage_ids,
+            named_stage_ids,
+            course_cmd_counts,
+            world_offsets,
+        )
+    finally:
+        root_logger.removeHandler(collector)
+
+    # Only offsets validated against the stage folder are worth remembering.
+    if use_registry and stage_ids:
+        tables["warnings"] = collector.messages
+        record_rom_tables(registry_dir, fingerprint, key, tables)
+
+    return data
+
+
+def locate_course_data(
+    mainloop_buffer,
+    stgname_lines,
+    bonus_stage_ids,
+    stage_id_to_theme_id_map,
+    theme_id_to_music_id_map,
+    stage_ids: Set[int],
+    named_stage_ids: Set[int],
+    course_cmd_counts: Optional[Dict[str, int]],
+    world_offsets: Optional[List[int]],
+) -> Tuple[dict, dict]:
+    """Find and parse the course tables; returns the data and its table offsets."""
     # Parse challenge mode entries using default offsets first.
     counts = course_cmd_counts or {}
+    vanilla_tables = KNOWN_ROM_TABLES["vanilla"]
     default_course_offsets = [
-        ("beginner", 0x002075B0),
-        ("advanced", 0x00207914),
-        ("expert", 0x00208634),
-        ("beginner_extra", 0x00209CF4),
-        ("advanced_extra", 0x0020A0C8),
-        ("expert_extra", 0x0020A448),
-        ("master", 0x0020A8E0),
-        ("master_extra", 0x0020ACB4),
+        (name, offset) for name, (offset, _) in vanilla_tables["courses"].items()
     ]
     cm_layout: Dict[str, List[dict]] = {}
+    course_tables = {name: [offset, counts.get(name)] for name, offset in default_course_offsets}
     for name, offset in default_course_offsets:
         try:
             cm_layout[name] = parse_cm_course(
@@ -607,8 +857,10 @@ def load_vanilla_course_data(
         logging.warning("Default course offsets invalid; scanning for course tables.")
         offsets = find_course_offsets(mainloop_buffer, stage_ids, named_stage_ids)
         order = [name for name, _ in default_course_offsets]
+        course_tables = {}
         for idx, (offset, cmd_count) in enumerate(offsets[: len(order)]):
             name = order[idx]
+            course_tables[name] = [offset, cmd_count]
             try:
                 cm_layout[name] = parse_cm_course(
                     mainloop_buffer,
@@ -628,18 +880,7 @@ def load_vanilla_course_data(
         raise SystemExit("Failed to locate challenge course tables.")
 
     if world_offsets is None:
-        world_offsets = [
-            0x0020b448,
-            0x0020b470,
-            0x0020b498,
-            0x0020b4c0,
-            0x0020b4e8,
-            0x0020b510,
-            0x0020b538,
-            0x0020b560,
-            0x0020b588,
-            0x0020b5b0,
-        ]
+        world_offsets = list(vanilla_tables["story"])
     worlds = []
     for offs in world_offsets:
         if stage_ids and not is_story_world_valid(mainloop_buffer, offs, stage_ids, named_stage_ids):
@@ -667,6 +908,7 @@ def load_vanilla_course_data(
 
     if not worlds and stage_ids:
         logging.warning("Default story offsets invalid; scanning for story table.")
+        world_offsets = []
         base_off = find_story_block_offset(mainloop_buffer, stage_ids, named_stage_ids)
         if base_off is not None:
             world_offsets = [base_off + i * 0x28 for i in range(10)]
@@ -683,10 +925,115 @@ def load_vanilla_course_data(
     if not worlds:
         logging.warning("Story world data not found; output will omit story worlds.")
 
-    return {
+    data = {
         "challenge": cm_layout,
         "story": worlds,
     }
+    return data, {"courses": course_tables, "story": list(world_offsets) if worlds else []}
+
+
+class WarningCollector(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.WARNING)
+        self.messages: List[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(record.getMessage())
+
+
+def collect_rom_dirs(patterns: List[str]) -> List[Path]:
+    """Expand ROM folder arguments; globs keep only matching directories."""
+    rom_dirs: List[Path] = []
+    seen: Set[Path] = set()
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = [Path(match) for match in sorted(glob.glob(pattern))]
+            matches = [match for match in matches if match.is_dir()]
+        else:
+            matches = [Path(pattern)]
+        for match in matches:
+            if match not in seen:
+                seen.add(match)
+                rom_dirs.append(match)
+    return rom_dirs
+
+
+def dump_rom_record(
+    rom_dir: Path, registry_dir: Optional[Path] = None, use_registry: bool = True
+) -> dict:
+    """Load one ROM's course data as a batch record; never raises."""
+    collector = WarningCollector()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(collector)
+    start = time.perf_counter()
+    try:
+        data = load_vanilla_course_data(
+            rom_dir, registry_dir=registry_dir, use_registry=use_registry
+        )
+        error = None
+    except (Exception, SystemExit) as exc:
+        data = None
+        error = str(exc) or type(exc).__name__
+    finally:
+        root_logger.removeHandler(collector)
+    record = {
+        "rom": str(rom_dir),
+        "ok": error is None,
+        "seconds": round(time.perf_counter() - start, 6),
+        "warnings": collector.messages,
+    }
+    if error is None:
+        record["data"] = data
+    else:
+        record["error"] = error
+    return record
+
+
+def run_batch(
+    patterns: List[str],
+    jobs: int,
+    out=sys.stdout,
+    registry_dir: Optional[Path] = None,
+    use_registry: bool = True,
+) -> int:
+    """Dump every ROM folder as one JSON line, in completion order.
+
+    Returns the number of ROMs that failed; a failure never stops the batch.
+    """
+    rom_dirs = collect_rom_dirs(patterns)
+    failures = 0
+
+    def emit(record: dict) -> None:
+        nonlocal failures
+        if not record["ok"]:
+            failures += 1
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    if jobs <= 1 or len(rom_dirs) <= 1:
+        for rom_dir in rom_dirs:
+            emit(dump_rom_record(rom_dir, registry_dir, use_registry))
+        return failures
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(rom_dirs))) as executor:
+        futures = {
+            executor.submit(dump_rom_record, rom_dir, registry_dir, use_registry): rom_dir
+            for rom_dir in rom_dirs
+        }
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as exc:
+                # The worker itself died (e.g. BrokenProcessPool).
+                record = {
+                    "rom": str(futures[future]),
+                    "ok": False,
+                    "seconds": None,
+                    "warnings": [],
+                    "error": str(exc) or type(exc).__name__,
+                }
+            emit(record)
+    return failures
 
 
 def main() -> None:
@@ -701,9 +1048,42 @@ def main() -> None:
         default=VANILLA_ROOT_PATH,
         help="Path to extracted ROM folder (containing mkb2.main_loop.rel)",
     )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="ROM_OR_GLOB",
+        help="Dump many ROM folders (paths or quoted globs) as JSON lines on stdout",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=0,
+        help="Worker processes for --batch (0 = CPU count)",
+    )
+    parser.add_argument(
+        "--registry",
+        type=Path,
+        help="Shared ROM cache directory (default: %s)" % default_rom_cache_dir(),
+    )
+    parser.add_argument(
+        "--no-registry",
+        action="store_true",
+        help="Always validate/scan table offsets and do not record them",
+    )
     args = parser.parse_args()
+    use_registry = not args.no_registry
 
-    data = load_vanilla_course_data(args.rom)
+    if args.batch:
+        jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+        if run_batch(
+            args.batch, jobs, registry_dir=args.registry, use_registry=use_registry
+        ):
+            sys.exit(1)
+        return
+
+    data = load_vanilla_course_data(
+        args.rom, registry_dir=args.registry, use_registry=use_registry
+    )
     cm_layout_dump = json.dumps(data["challenge"], indent=4)
     annotated_cm_layout_dump = annotate_cm_layout_dump(cm_layout_dump)
     print(annotated_cm_layout_dump)
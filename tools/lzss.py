@@ -0,0 +1,436 @@
+"""SMB `.lz` (LZSS) codec and the on-disk cache of decompressed payloads."""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from rom_cache import default_cache_root
+
+
+LZSS_HEADER_SIZE = 8
+
+
+LZSS_RING_SIZE = 4096
+LZSS_RING_START = 4078
+
+
+def _build_lzss_group_structs() -> List[Tuple[struct.Struct, int]]:
+    # One precompiled struct per flag byte: literal runs unpack as a single
+    # bytes item, back-references as a big-endian u16 (lo << 8 | hi).
+    table = []
+    for flags in range(256):
+        fmt = '>'
+        size = 0
+        bit = 0
+        while bit < 8:
+            if (flags >> bit) & 1:
+                run = 0
+                while bit < 8 and (flags >> bit) & 1:
+                    run += 1
+                    bit += 1
+                fmt += f'{run}s'
+                size += run
+            else:
+                fmt += 'H'
+                size += 2
+                bit += 1
+        table.append((struct.Struct(fmt), size))
+    return table
+
+
+LZSS_GROUP_STRUCTS = _build_lzss_group_structs()
+
+
+def _lzss_tail_items(src: bytes, srcp: int, flags: int) -> List[object]:
+    # Decode a final flag group that runs past the end of the source, keeping
+    # every token that is complete and dropping the first truncated one.
+    items: List[object] = []
+    src_len = len(src)
+    for bit in range(8):
+        if (flags >> bit) & 1:
+            if srcp >= src_len:
+                break
+            items.append(src[srcp:srcp + 1])
+            srcp += 1
+        else:
+            if srcp + 1 >= src_len:
+                break
+            items.append((src[srcp] << 8) | src[srcp + 1])
+            srcp += 2
+    return items
+
+
+class LzssStream:
+    """Incremental decoder for SMB `.lz` buffers; `window(end)` decodes only the first `end` bytes."""
+
+    def __init__(self, buffer: bytes) -> None:
+        self.size = 0
+        self._src = b''
+        self._srcp = 0
+        # The ring's initial zeros prefix the output, so back-references are plain slices.
+        self._out = bytearray(LZSS_RING_SIZE)
+        if len(buffer) < 8:
+            return
+        src_size, dest_size = struct.unpack_from('<II', buffer, 0)
+        if src_size <= 8 or dest_size <= 0:
+            return
+        self.size = dest_size
+        self._src = bytes(buffer[8:src_size])
+
+    @property
+    def decoded(self) -> int:
+        return min(len(self._out) - LZSS_RING_SIZE, self.size)
+
+    def ensure(self, end: int) -> None:
+        target = LZSS_RING_SIZE + min(end, self.size)
+        out = self._out
+        destp = len(out)
+        if destp >= target:
+            return
+        src = self._src
+        src_len = len(src)
+        srcp = self._srcp
+        # Ring slot of output byte k is (LZSS_RING_START + k) & 4095, and output
+        # byte k lives at out[LZSS_RING_SIZE + k].
+        ring_bias = LZSS_RING_START - LZSS_RING_SIZE
+        groups = LZSS_GROUP_STRUCTS
+        while srcp < src_len and destp < target:
+            flags = src[srcp]
+            srcp += 1
+            group, size = groups[flags]
+            if srcp + size <= src_len:
+                items = group.unpack_from(src, srcp)
+                srcp += size
+            else:
+                items = _lzss_tail_items(src, srcp, flags)
+                srcp = src_len
+            for item in items:
+                if item.__class__ is bytes:
+                    out += item
+                    destp += len(item)
+                    continue
+                length = (item & 0x0F) + 3
+                ring_off = (item >> 8) | ((item & 0xF0) << 4)
+                dist = ((destp + ring_bias - ring_off) & 4095) or LZSS_RING_SIZE
+                start = destp - dist
+                if dist >= length:
+                    out += out[start:start + length]
+                else:
+                    out += (out[start:destp] * (length // dist + 1))[:length]
+                destp += length
+        self._srcp = srcp
+
+    def window(self, end: int) -> bytes:
+        """Return output bytes [0, end); like `lzss_decompress`, a truncated stream reads as zeros."""
+        end = max(0, min(end, self.size))
+        self.ensure(end)
+        data = bytes(self._out[LZSS_RING_SIZE:LZSS_RING_SIZE + end])
+        if len(data) < end:
+            data += bytes(end - len(data))
+        return data
+
+    def read_all(self) -> bytes:
+        return self.window(self.size)
+
+
+def lzss_decompress(buffer: bytes) -> bytes:
+    """Decode an SMB `.lz` buffer (same output as `lzssDecompress` in src/lzs.ts)."""
+    return LzssStream(buffer).read_all()
+
+
+LZSS_MIN_MATCH = 3
+LZSS_MAX_MATCH = 18
+# Compression level -> hash chain search depth.
+LZSS_LEVELS = {
+    'fast': 8,
+    'normal': 64,
+    'max': 256,
+}
+# Pseudo level for packs that store `.lz` files decompressed, so clients skip
+# LZSS and leave transport compression to HTTP or the zip.
+LZ_LEVEL_DECOMPRESSED = 'decompressed'
+# Encoded cost in bits, including the token's flag bit.
+LZSS_LITERAL_BITS = 9
+LZSS_MATCH_BITS = 17
+
+
+class _LzssMatchFinder:
+    """Hash-chain match finder over the output prefixed with the ring's zeros."""
+
+    def __init__(self, data: bytes, depth: int) -> None:
+        self.window = bytes(LZSS_RING_SIZE) + data
+        self.end = len(self.window)
+        self.depth = depth
+        self.chains: Dict[bytes, List[int]] = {}
+        # Every zero-prefix position holds the same bytes; only the last
+        # LZSS_MAX_MATCH can start a distinct match, and they stay in range longest.
+        for pos in range(LZSS_RING_SIZE - LZSS_MAX_MATCH, LZSS_RING_SIZE):
+            self.insert(pos)
+
+    def insert(self, pos: int) -> None:
+        key = self.window[pos:pos + LZSS_MIN_MATCH]
+        chain = self.chains.get(key)
+        if chain is None:
+            self.chains[key] = [pos]
+        else:
+            chain.append(pos)
+
+    def longest(self, pos: int) -> Tuple[int, int]:
+        """Return (length, distance) of the longest match at `pos`, or (0, 0)."""
+        window = self.window
+        limit = min(LZSS_MAX_MATCH, self.end - pos)
+        if limit < LZSS_MIN_MATCH:
+            return 0, 0
+        chain = self.chains.get(window[pos:pos + LZSS_MIN_MATCH])
+        if not chain:
+            return 0, 0
+        lowest = pos - LZSS_RING_SIZE
+        best_len = 0
+        best_pos = 0
+        stop = max(-1, len(chain) - 1 - self.depth)
+        for idx in range(len(chain) - 1, stop, -1):
+            cand = chain[idx]
+            if cand < lowest:
+                break
+            if best_len and window[cand + best_len] != window[pos + best_len]:
+                continue
+            length = LZSS_MIN_MATCH
+            while length < limit and window[cand + length] == window[pos + length]:
+                length += 1
+            if length > best_len:
+                best_len = length
+                best_pos = cand
+                if length == limit:
+                    break
+        return best_len, pos - best_pos
+
+
+def _lzss_parse_greedy(finder: _LzssMatchFinder, lazy: bool) -> List[object]:
+    tokens: List[object] = []
+    window = finder.window
+    pos = LZSS_RING_SIZE
+    end = finder.end
+    pending: Optional[Tuple[int, int]] = None
+    while pos < end:
+        match = pending if pending is not None else finder.longest(pos)
+        pending = None
+        length, dist = match
+        if lazy and length and length < LZSS_MAX_MATCH and pos + 1 < end:
+            finder.insert(pos)
+            pending = finder.longest(pos + 1)
+            if pending[0] > length:
+                tokens.append(window[pos])
+                pos += 1
+                continue
+            start = pos + 1
+            pending = None
+        else:
+            start = pos
+        if length:
+            tokens.append((length, dist))
+            for inner in range(start, pos + length):
+                finder.insert(inner)
+            pos += length
+        else:
+            tokens.append(window[pos])
+            finder.insert(pos)
+            pos += 1
+    return tokens
+
+
+def _lzss_parse_optimal(finder: _LzssMatchFinder) -> List[object]:
+    window = finder.window
+    start = LZSS_RING_SIZE
+    count = finder.end - start
+    matches: List[Tuple[int, int]] = []
+    for pos in range(start, finder.end):
+        matches.append(finder.longest(pos))
+        finder.insert(pos)
+    # Every prefix of the longest match at a position is also a match, so the
+    # cheapest parse follows from a backwards pass over (length, distance).
+    cost = [0] * (count + 1)
+    choice = [0] * count
+    for idx in range(count - 1, -1, -1):
+        best = cost[idx + 1] + LZSS_LITERAL_BITS
+        best_len = 0
+        max_len = matches[idx][0]
+        for length in range(LZSS_MIN_MATCH, max_len + 1):
+            candidate = cost[idx + length] + LZSS_MATCH_BITS
+            if candidate <= best:
+                best = candidate
+                best_len = length
+        cost[idx] = best
+        choice[idx] = best_len
+    tokens: List[object] = []
+    idx = 0
+    while idx < count:
+        length = choice[idx]
+        if length:
+            tokens.append((length, matches[idx][1]))
+            idx += length
+        else:
+            tokens.append(window[start + idx])
+            idx += 1
+    return tokens
+
+
+def lzss_compress(data: bytes, level: str = 'normal') -> bytes:
+    """Encode `data` in the SMB `.lz` format at one of LZSS_LEVELS."""
+    depth = LZSS_LEVELS.get(level)
+    if depth is None:
+        raise ValueError(f'unknown LZSS level: {level}')
+    finder = _LzssMatchFinder(bytes(data), depth)
+    if level == 'max':
+        tokens = _lzss_parse_optimal(finder)
+    else:
+        tokens = _lzss_parse_greedy(finder, lazy=level != 'fast')
+    body = bytearray()
+    ring_pos = LZSS_RING_START
+    for group_start in range(0, len(tokens), 8):
+        flag_index = len(body)
+        body.append(0)
+        flags = 0
+        for bit, token in enumerate(tokens[group_start:group_start + 8]):
+            if token.__class__ is int:
+                flags |= 1 << bit
+                body.append(token)
+                ring_pos += 1
+                continue
+            length, dist = token
+            ring_off = (ring_pos - dist) & 4095
+            body.append(ring_off & 0xFF)
+            body.append(((ring_off >> 4) & 0xF0) | (length - LZSS_MIN_MATCH))
+            ring_pos += length
+        body[flag_index] = flags
+    return struct.pack('<II', len(body) + 8, len(data)) + bytes(body)
+
+
+DEFAULT_LZ_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def default_lz_cache_dir() -> Path:
+    return default_cache_root() / 'lzss-v1'
+
+
+class DecompressedCache:
+    """LRU on-disk cache of decompressed `.lz` payloads, keyed by the sha256 of the compressed bytes."""
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_LZ_CACHE_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes: Optional[int] = None
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / key[:2] / f'{key}.bin'
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        if not self.root.exists():
+            return entries
+        for path in self.root.glob('*/*.bin'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def lookup(self, raw: bytes) -> Optional[mmap.mmap]:
+        """Return a read-only mmap of the cached payload (close it with `close_buffer`), or None."""
+        return self._open(self._entry_path(hashlib.sha256(raw).hexdigest()))
+
+    def _open(self, path: Path) -> Optional[mmap.mmap]:
+        # Refresh the LRU mtime before mapping, so nothing can fail with the
+        # mapping open; a read-only cache still serves hits.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        try:
+            with path.open('rb') as handle:
+                data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def decompress(self, raw: bytes) -> Union[bytes, mmap.mmap]:
+        """Return the decompressed payload, decoding and storing it on a miss."""
+        path = self._entry_path(hashlib.sha256(raw).hexdigest())
+        data = self._open(path)
+        if data is not None:
+            return data
+        data = lzss_decompress(raw)
+        if data:
+            self._store(path, data)
+        return data
+
+    def store(self, raw: bytes, data: bytes) -> None:
+        if data:
+            self._store(self._entry_path(hashlib.sha256(raw).hexdigest()), data)
+
+    def _store(self, path: Path, data: bytes) -> None:
+        # A unique temp name per write, since builder threads may store at once.
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(prefix=f'{path.name}.', suffix='.tmp', dir=path.parent)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(data)
+            os.replace(tmp_name, path)
+        except OSError:
+            Path(tmp_name).unlink(missing_ok=True)
+            return
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        else:
+            self._total_bytes += len(data)
+        if self._total_bytes > self.max_bytes:
+            self.trim()
+
+    def trim(self) -> None:
+        entries = sorted(self._entries(), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+        self._total_bytes = total
+
+
+def close_buffer(data: object) -> None:
+    if isinstance(data, mmap.mmap):
+        data.close()
+
+
+def decompress_lz(raw: bytes, cache: Optional[DecompressedCache] = None) -> Union[bytes, mmap.mmap]:
+    if cache is None:
+        return lzss_decompress(raw)
+    return cache.decompress(raw)
+
+
+def recompress_lz_data(raw: bytes, level: str, cache: Optional[DecompressedCache] = None) -> Optional[bytes]:
+    """Re-encode `.lz` data at `level`; None unless smaller (LZ_LEVEL_DECOMPRESSED always returns it)."""
+    data = decompress_lz(raw, cache)
+    try:
+        if level == LZ_LEVEL_DECOMPRESSED:
+            return bytes(data)
+        packed = lzss_compress(data, level) if data else raw
+    finally:
+        close_buffer(data)
+    return packed if len(packed) < len(raw) else None
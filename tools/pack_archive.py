@@ -0,0 +1,312 @@
+"""Pack zip and range-readable `.smbpack` container writers, plus a container reader."""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from lzss import LZ_LEVEL_DECOMPRESSED, LZSS_HEADER_SIZE, DecompressedCache, recompress_lz_data
+
+
+def describe_pack_file(header: bytes, size: int, digest: str, lz_compressed: bool) -> Dict[str, object]:
+    """Return a manifest `files` entry; `header` holds the file's first bytes."""
+    entry: Dict[str, object] = {'size': size, 'sha256': digest}
+    if lz_compressed and len(header) >= LZSS_HEADER_SIZE:
+        entry['decompressedSize'] = struct.unpack_from('<I', header, 4)[0]
+    return entry
+
+
+# Members already LZSS-compressed are stored; deflating them again gains nothing.
+ZIP_STORED_SUFFIXES = ('.lz',)
+ZIP_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+ZIP_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+ZIP_END_RECORD = struct.Struct('<IHHHHIIH')
+ZIP_MAX_SIZE = 0xFFFFFFFF
+
+
+@dataclass
+class ZipMember:
+    name: str
+    path: Optional[Path] = None
+    data: Optional[bytes] = None
+    lz_level: Optional[str] = None
+    lz_cache: Optional[DecompressedCache] = None
+    deflate: Optional[bool] = None  # None: deflate unless the name is in ZIP_STORED_SUFFIXES
+
+
+def load_zip_member(member: ZipMember) -> Tuple[bytes, Optional[bytes], float]:
+    """Return a member's bytes, their raw deflate stream (None if stored) and mtime."""
+    if member.data is not None:
+        data, mtime = member.data, time.time()
+    else:
+        mtime = member.path.stat().st_mtime
+        data = member.path.read_bytes()
+        if member.lz_level:
+            data = recompress_lz_data(data, member.lz_level, member.lz_cache) or data
+    if not (member.deflate if member.deflate is not None else not member.name.endswith(ZIP_STORED_SUFFIXES)):
+        return data, None, mtime
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    return data, compressor.compress(data) + compressor.flush(), mtime
+
+
+class PackZipWriter:
+    """Sequential ZIP writer for members deflated ahead of time (no ZIP64)."""
+
+    def __init__(self, path: Path) -> None:
+        self._file = path.open('wb')
+        self._central: List[bytes] = []
+        self._offset = 0
+
+    def __enter__(self) -> 'PackZipWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def add(self, name: str, data: bytes, deflated: Optional[bytes], mtime: float) -> None:
+        payload = data if deflated is None else deflated
+        if len(data) > ZIP_MAX_SIZE or self._offset + len(payload) > ZIP_MAX_SIZE:
+            raise ValueError(f'{name}: pack zip would exceed 4 GiB')
+        name_bytes = name.encode('utf-8')
+        flags = 0 if name.isascii() else 0x800
+        method = zipfile.ZIP_STORED if deflated is None else zipfile.ZIP_DEFLATED
+        stamp = time.localtime(mtime)
+        if stamp.tm_year < 1980:
+            dos_time, dos_date = 0, (1 << 5) | 1
+        else:
+            dos_time = (stamp.tm_hour << 11) | (stamp.tm_min << 5) | (stamp.tm_sec // 2)
+            dos_date = ((stamp.tm_year - 1980) << 9) | (stamp.tm_mon << 5) | stamp.tm_mday
+        crc = zlib.crc32(data)
+        header = ZIP_LOCAL_HEADER.pack(
+            0x04034b50, 20, flags, method, dos_time, dos_date,
+            crc, len(payload), len(data), len(name_bytes), 0,
+        )
+        self._central.append(ZIP_CENTRAL_HEADER.pack(
+            0x02014b50, (3 << 8) | 20, 20, flags, method, dos_time, dos_date,
+            crc, len(payload), len(data), len(name_bytes), 0, 0, 0, 0, 0o100644 << 16, self._offset,
+        ) + name_bytes)
+        self._file.write(header)
+        self._file.write(name_bytes)
+        self._file.write(payload)
+        self._offset += len(header) + len(name_bytes) + len(payload)
+
+    def close(self) -> None:
+        central = b''.join(self._central)
+        count = len(self._central)
+        self._file.write(central)
+        self._file.write(ZIP_END_RECORD.pack(0x06054b50, 0, 0, count, count, len(central), self._offset, 0))
+        self._file.close()
+
+
+def iter_loaded_members(
+    members: Iterable[ZipMember],
+    workers: int,
+) -> Iterator[Tuple[ZipMember, bytes, Optional[bytes], float]]:
+    """Yield (member, *load_zip_member(member)) in order, loading/deflating on threads."""
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Bounded look-ahead keeps at most a few deflated members in memory.
+        pending = deque()
+        for member in members:
+            pending.append((member, executor.submit(load_zip_member, member)))
+            if len(pending) >= workers * 4:
+                member, future = pending.popleft()
+                yield (member, *future.result())
+        while pending:
+            member, future = pending.popleft()
+            yield (member, *future.result())
+
+
+def write_pack_zip(
+    zip_path: Path,
+    members: Iterable[ZipMember],
+    workers: int,
+    trailer: Optional[Callable[[Dict[str, Dict[str, object]]], ZipMember]] = None,
+    container: Optional[PackContainerWriter] = None,
+) -> None:
+    """Write `members`, then the `trailer` member built from their manifest entries, to the zip and `container`."""
+    zip_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = zip_path.with_name(f'{zip_path.name}.{os.getpid()}.tmp')
+    files: Dict[str, Dict[str, object]] = {}
+    try:
+        with PackZipWriter(tmp_path) as writer:
+            for member, data, deflated, mtime in iter_loaded_members(members, workers):
+                writer.add(member.name, data, deflated, mtime)
+                if container is not None:
+                    container.add(member.name, data, deflated)
+                if trailer is not None:
+                    lz_compressed = member.name.endswith('.lz') and member.lz_level != LZ_LEVEL_DECOMPRESSED
+                    files[member.name] = describe_pack_file(
+                        data[:LZSS_HEADER_SIZE], len(data), hashlib.sha256(data).hexdigest(), lz_compressed,
+                    )
+            if trailer is not None:
+                member = trailer(dict(sorted(files.items())))
+                data, deflated, mtime = load_zip_member(member)
+                writer.add(member.name, data, deflated, mtime)
+                if container is not None:
+                    container.add(member.name, data, deflated)
+        os.replace(tmp_path, zip_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+# Range-readable pack container (<out>.smbpack). All integers are little-endian:
+#   header  magic, version, member count, index size
+#   index   per member: offset, stored size, size, crc32, method, name length, name
+#   data    members, each starting on a PACK_CONTAINER_ALIGN boundary
+# The index sits at the front and every member is compressed on its own, so a
+# client can fetch the index and then any single file with one Range request.
+PACK_CONTAINER_SUFFIX = '.smbpack'
+PACK_CONTAINER_MAGIC = b'SMBPACK\x00'
+PACK_CONTAINER_VERSION = 1
+PACK_CONTAINER_HEADER = struct.Struct('<8sIII')
+PACK_CONTAINER_ENTRY = struct.Struct('<QIIIBxH')
+PACK_CONTAINER_ALIGN = 512
+PACK_CONTAINER_STORED = 0
+PACK_CONTAINER_DEFLATED = 1
+
+
+@dataclass
+class PackContainerEntry:
+    name: str
+    offset: int
+    stored_size: int
+    size: int
+    crc: int
+    method: int
+
+
+def align_up(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+class PackContainerWriter:
+    """Streams the data section first and fills in the index of `names` on close."""
+
+    def __init__(self, path: Path, names: List[str]) -> None:
+        self.path = path
+        self._names = names
+        self._index_size = sum(PACK_CONTAINER_ENTRY.size + len(name.encode('utf-8')) for name in names)
+        self._offset = align_up(PACK_CONTAINER_HEADER.size + self._index_size, PACK_CONTAINER_ALIGN)
+        self._entries: Dict[str, bytes] = {}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        self._file = self._tmp_path.open('wb')
+
+    def __enter__(self) -> 'PackContainerWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._tmp_path.unlink(missing_ok=True)
+
+    def add(self, name: str, data: bytes, deflated: Optional[bytes]) -> None:
+        payload = data if deflated is None else deflated
+        method = PACK_CONTAINER_STORED if deflated is None else PACK_CONTAINER_DEFLATED
+        if len(data) > ZIP_MAX_SIZE:
+            raise ValueError(f'{name}: pack container members must stay under 4 GiB')
+        name_bytes = name.encode('utf-8')
+        self._entries[name] = PACK_CONTAINER_ENTRY.pack(
+            self._offset, len(payload), len(data), zlib.crc32(data), method, len(name_bytes),
+        ) + name_bytes
+        self._file.seek(self._offset)
+        self._file.write(payload)
+        self._offset = align_up(self._offset + len(payload), PACK_CONTAINER_ALIGN)
+
+    def close(self) -> None:
+        try:
+            missing = [name for name in self._names if name not in self._entries]
+            if missing:
+                raise ValueError(f'{self.path}: no data for {missing[0]}')
+            handle = self._file
+            handle.truncate(max(handle.tell(), PACK_CONTAINER_HEADER.size + self._index_size))
+            handle.seek(0)
+            handle.write(PACK_CONTAINER_HEADER.pack(
+                PACK_CONTAINER_MAGIC, PACK_CONTAINER_VERSION, len(self._names), self._index_size,
+            ))
+            handle.write(b''.join(self._entries[name] for name in self._names))
+            handle.close()
+            os.replace(self._tmp_path, self.path)
+        finally:
+            self._file.close()
+            self._tmp_path.unlink(missing_ok=True)
+
+
+def write_pack_container(path: Path, members: Iterable[ZipMember], workers: int) -> None:
+    members = list(members)
+    with PackContainerWriter(path, [member.name for member in members]) as writer:
+        for member, data, deflated, _mtime in iter_loaded_members(members, workers):
+            writer.add(member.name, data, deflated)
+
+
+class PackContainerReader:
+    """Random access to the members of a `.smbpack` container."""
+
+    def __init__(self, path: Path) -> None:
+        self._file = path.open('rb')
+        try:
+            header = self._file.read(PACK_CONTAINER_HEADER.size)
+            if len(header) < PACK_CONTAINER_HEADER.size:
+                raise ValueError(f'{path}: truncated pack container header')
+            magic, version, count, index_size = PACK_CONTAINER_HEADER.unpack(header)
+            if magic != PACK_CONTAINER_MAGIC:
+                raise ValueError(f'{path}: not a pack container')
+            if version != PACK_CONTAINER_VERSION:
+                raise ValueError(f'{path}: unsupported pack container version {version}')
+            index = self._file.read(index_size)
+            if len(index) < index_size:
+                raise ValueError(f'{path}: truncated pack container index')
+        except BaseException:
+            self._file.close()
+            raise
+        self.entries: Dict[str, PackContainerEntry] = {}
+        pos = 0
+        for _ in range(count):
+            offset, stored_size, size, crc, method, name_len = PACK_CONTAINER_ENTRY.unpack_from(index, pos)
+            pos += PACK_CONTAINER_ENTRY.size
+            name = index[pos:pos + name_len].decode('utf-8')
+            pos += name_len
+            self.entries[name] = PackContainerEntry(name, offset, stored_size, size, crc, method)
+
+    def __enter__(self) -> 'PackContainerReader':
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def names(self) -> List[str]:
+        return list(self.entries)
+
+    def read(self, name: str) -> bytes:
+        entry = self.entries.get(name)
+        if entry is None:
+            raise KeyError(f'missing pack entry: {name}')
+        self._file.seek(entry.offset)
+        payload = self._file.read(entry.stored_size)
+        if entry.method == PACK_CONTAINER_DEFLATED:
+            data = zlib.decompress(payload, -15)
+        elif entry.method == PACK_CONTAINER_STORED:
+            data = payload
+        else:
+            raise ValueError(f'{name}: unknown pack container method {entry.method}')
+        if len(data) != entry.size or zlib.crc32(data) != entry.crc:
+            raise ValueError(f'{name}: pack container member is corrupt')
+        return data
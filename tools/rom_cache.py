@@ -0,0 +1,70 @@
+"""Per-REL cache of mkb2.main_loop.rel analysis shared by the SMB2 ROM tools.
+
+One JSON file per REL and section, `<sha256 of the REL>.<section>.json`, holding
+`{'key': ..., 'data': ...}`; `key` hashes the section's other inputs.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+ROM_CACHE_VERSION = 1
+
+
+def default_cache_root() -> Path:
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    base = Path(cache_home) if cache_home else Path.home() / '.cache'
+    return base / 'smb2_pack_builder'
+
+
+def default_rom_cache_dir() -> Path:
+    return default_cache_root() / f'roms-v{ROM_CACHE_VERSION}'
+
+
+def rel_fingerprint(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def rom_entry_path(cache_dir: Path, fingerprint: str, section: str) -> Path:
+    return cache_dir / f'{fingerprint}.{section}.json'
+
+
+def read_rom_entry(fingerprint: str, section: str, key: str = '', cache_dir: Optional[Path] = None) -> Optional[object]:
+    """Return the cached `section` of a REL, or None when missing or stale."""
+    path = rom_entry_path(cache_dir or default_rom_cache_dir(), fingerprint, section)
+    try:
+        entry = json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get('key') != key:
+        return None
+    return entry.get('data')
+
+
+def write_rom_entry(
+    fingerprint: str,
+    section: str,
+    data: object,
+    key: str = '',
+    cache_dir: Optional[Path] = None,
+) -> Optional[str]:
+    """Store `section` of a REL; returns an error message instead of raising."""
+    path = rom_entry_path(cache_dir or default_rom_cache_dir(), fingerprint, section)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=f'{path.name}.', suffix='.tmp', dir=path.parent)
+    except OSError as exc:
+        return f'could not update ROM cache {path}: {exc}'
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as handle:
+            json.dump({'key': key, 'data': data}, handle)
+        os.replace(tmp_name, path)
+    except OSError as exc:
+        Path(tmp_name).unlink(missing_ok=True)
+        return f'could not update ROM cache {path}: {exc}'
+    return None
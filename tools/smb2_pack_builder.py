@@ -8,21 +8,59 @@ copies only required stage/bg/init files into a pack folder (and optional zip).
 from __future__ import annotations
 
 import argparse
+import errno
+import gzip
+import hashlib
 import json
 import os
 import re
 import shutil
-import struct
 import sys
-import zipfile
+import time
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Tuple
 
+from binary_view import BinaryView
+from build_journal import BUILD_JOURNAL_NAME, BuildJournal
+from lzss import (
+    DEFAULT_LZ_CACHE_MAX_BYTES,
+    LZ_LEVEL_DECOMPRESSED,
+    LZSS_HEADER_SIZE,
+    LZSS_LEVELS,
+    DecompressedCache,
+    LzssStream,
+    close_buffer,
+    default_lz_cache_dir,
+    recompress_lz_data,
+)
+from pack_archive import (
+    PACK_CONTAINER_SUFFIX,
+    PackContainerWriter,
+    ZipMember,
+    describe_pack_file,
+    write_pack_container,
+    write_pack_zip,
+)
+from rom_cache import read_rom_entry, rel_fingerprint, write_rom_entry
+
+try:
+    import brotli
+except ImportError:  # Optional; precompressed sidecars are then gzip only.
+    brotli = None
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; build profiles then omit RSS and worker CPU.
+    resource = None
+
 STAGE_WORLD_THEMES_LEN = 420
 BG_NAME_COUNT = 43
 THEME_LIGHT_COUNT = 41
 KEYFRAME_SIZE = 0x14
+STAGEDEF_HEADER_SIZE = 0xc0
+STAGE_FOG_SIZE = 0x18
+FOG_ANIM_HEADER_SIZE = 0x28
 
 # Default symbol addresses from mkb2.us.lst (NTSC SMB2).
 DEFAULT_SYMBOLS = {
@@ -81,10 +119,13 @@ BG_NAME_TABLE: List[Optional[str]] = [
     None,  # 42
 ]
 
-# REL relocation constants (PowerPC REL format)
-R_PPC_NONE = 0
-R_PPC_SECTION = 202
+# Keyframe table columns, in record order.
+KEYFRAME_FIELDS = ('ease', 't', 'v', 'in', 'out')
+KeyframeColumns = Dict[str, List[float]]
 
+# pack.json encodings for fog anim keyframe tracks.
+KEYFRAME_ENCODING_OBJECTS = 'objects'
+KEYFRAME_ENCODING_COLUMNAR = 'columnar'
 
 @dataclass
 class RelSection:
@@ -101,22 +142,13 @@ class RelHeader:
     imp_size: int
 
 
-@dataclass
-class Relocation:
-    patch_section: int
-    patch_offset: int
-    rel_type: int
-    target_section: int
-    addend: int
-
-
 @dataclass
 class FogAnim:
-    start: Optional[List[Dict[str, float]]]
-    end: Optional[List[Dict[str, float]]]
-    r: Optional[List[Dict[str, float]]]
-    g: Optional[List[Dict[str, float]]]
-    b: Optional[List[Dict[str, float]]]
+    start: Optional[KeyframeColumns]
+    end: Optional[KeyframeColumns]
+    r: Optional[KeyframeColumns]
+    g: Optional[KeyframeColumns]
+    b: Optional[KeyframeColumns]
 
 
 @dataclass
@@ -128,79 +160,8 @@ class StageFog:
     anim: Optional[FogAnim]
 
 
-def read_u32_be(data: bytes, offset: int) -> int:
-    return struct.unpack_from('>I', data, offset)[0]
-
-
-def read_s32_be(data: bytes, offset: int) -> int:
-    return struct.unpack_from('>i', data, offset)[0]
-
-
-def read_f32_be(data: bytes, offset: int) -> float:
-    return struct.unpack_from('>f', data, offset)[0]
-
-
-def read_u16_be(data: bytes, offset: int) -> int:
-    return struct.unpack_from('>H', data, offset)[0]
-
-
-def read_s16_be(data: bytes, offset: int) -> int:
-    return struct.unpack_from('>h', data, offset)[0]
-
-
-def lzss_decompress(buffer: bytes) -> bytes:
-    if len(buffer) < 8:
-        return b''
-    src_size = struct.unpack_from('<I', buffer, 0)[0]
-    dest_size = struct.unpack_from('<I', buffer, 4)[0]
-    if src_size <= 8 or dest_size <= 0:
-        return b''
-    src = buffer[8:8 + (src_size - 8)]
-    dest = bytearray(dest_size)
-    ring = bytearray(4096)
-    buf_pos = 4078
-    flags = 0
-    srcp = 0
-    destp = 0
-    while True:
-        flags >>= 1
-        if (flags & 0x100) == 0:
-            if srcp >= len(src):
-                break
-            flags = src[srcp] | 0xFF00
-            srcp += 1
-        if flags & 1:
-            if srcp >= len(src):
-                break
-            byte = src[srcp]
-            srcp += 1
-            if destp >= len(dest):
-                break
-            dest[destp] = byte
-            ring[buf_pos] = byte
-            buf_pos = (buf_pos + 1) & 4095
-            destp += 1
-        else:
-            if srcp + 1 >= len(src):
-                break
-            offset = src[srcp]
-            r8 = src[srcp + 1]
-            srcp += 2
-            length = (r8 & 0x0F) + 2
-            offset |= (r8 & 0xF0) << 4
-            for i in range(length + 1):
-                byte = ring[(offset + i) & 4095]
-                if destp >= len(dest):
-                    break
-                dest[destp] = byte
-                ring[buf_pos] = byte
-                buf_pos = (buf_pos + 1) & 4095
-                destp += 1
-    return bytes(dest)
-
-
 def parse_rel_header(data: bytes) -> RelHeader:
-    header = struct.unpack_from('>IIIIIIIIIIIIIIII', data, 0)
+    header = BinaryView.of(data).unpack('16I', 0)
     (_, _, _, section_count, section_table_off,
      _, _, _, _, _, imp_off, imp_size,
      _, _, _, _) = header
@@ -212,58 +173,63 @@ def parse_rel_header(data: bytes) -> RelHeader:
 
 def parse_rel_sections(data: bytes, header: RelHeader) -> List[RelSection]:
     sections: List[RelSection] = []
-    for i in range(header.section_count):
-        off_flags, size = struct.unpack_from('>II', data, header.section_table_off + i * 8)
+    view = BinaryView.of(data)
+    for off_flags, size in view.records('II', header.section_table_off, header.section_count):
         off = off_flags & 0xFFFFFFFC
         flags = off_flags & 0x3
         sections.append(RelSection(offset=off, size=size, flags=flags))
     return sections
 
 
-def parse_relocations(data: bytes, header: RelHeader) -> List[Relocation]:
-    relocs: List[Relocation] = []
-    for i in range(0, header.imp_size, 8):
-        _, relocs_off = struct.unpack_from('>II', data, header.imp_off + i)
-        off = relocs_off
-        curr_section = None
-        curr_offset = 0
-        while off + 8 <= len(data):
-            delta, rel_type, rel_section = struct.unpack_from('>HBB', data, off)
-            addend = struct.unpack_from('>I', data, off + 4)[0]
-            off += 8
-            if rel_type == R_PPC_NONE:
-                break
-            if rel_type == R_PPC_SECTION:
-                curr_section = rel_section
-                curr_offset = 0
-                continue
-            if curr_section is None:
-                continue
-            curr_offset += delta
-            relocs.append(Relocation(
-                patch_section=curr_section,
-                patch_offset=curr_offset,
-                rel_type=rel_type,
-                target_section=rel_section,
-                addend=addend,
-            ))
-    return relocs
+STAGE_WORLD_THEME_MAX = 41
+STAGE_WORLD_THEMES_TAIL_LEN = 16
+# bytes.translate table: 0 for a valid theme id, 1 for anything larger.
+STAGE_WORLD_THEME_BAD_BYTES = bytes(int(value > STAGE_WORLD_THEME_MAX) for value in range(256))
 
 
 def find_stage_world_themes_offset(data: bytes, section: RelSection) -> Optional[int]:
+    """Find the first 420-byte run of theme ids (<= 41) followed by a `bg/` string."""
+    data = bytes(data)
+    table_len = STAGE_WORLD_THEMES_LEN
     start = section.offset
-    end = section.offset + section.size
-    max_val = 41
-    for off in range(start, end - STAGE_WORLD_THEMES_LEN):
-        chunk = data[off:off + STAGE_WORLD_THEMES_LEN]
-        if not chunk:
+    # Exclusive bound on candidate offsets (as in the windowed scan).
+    stop = min(section.offset + section.size - table_len, len(data))
+    if start >= stop:
+        return None
+    mask_end = min(stop - 1 + table_len, len(data))
+    bad = data[start:mask_end].translate(STAGE_WORLD_THEME_BAD_BYTES)
+    clean_window = bytes(table_len)
+
+    def first_tagged(first: int, last: int) -> Optional[int]:
+        # First offset in [first, last] whose tail holds `bg/`.
+        last = min(last, stop - 1)
+        if last < first:
+            return None
+        tag = data.find(b'bg/', first + table_len, last + table_len + STAGE_WORLD_THEMES_TAIL_LEN)
+        if tag == -1:
+            return None
+        return max(first, tag + 3 - table_len - STAGE_WORLD_THEMES_TAIL_LEN)
+
+    pos = 0
+    while True:
+        run_start = bad.find(clean_window, pos)
+        if run_start == -1:
             break
-        if max(chunk) > max_val:
-            continue
-        tail = data[off + STAGE_WORLD_THEMES_LEN:off + STAGE_WORLD_THEMES_LEN + 16]
-        if b'bg/' not in tail:
-            continue
-        return off
+        next_bad = bad.find(1, run_start + table_len)
+        run_end = len(bad) if next_bad == -1 else next_bad
+        if start + run_end == len(data):
+            # Windows are clipped at the end of the file.
+            found = first_tagged(start + run_start, start + run_end - 1)
+        else:
+            found = first_tagged(start + run_start, start + run_end - table_len)
+        if found is not None:
+            return found
+        pos = run_end + 1
+    if mask_end == len(data):
+        # A short valid run at the very end still passes the clipped check.
+        tail_start = max(bad.rfind(1) + 1, pos)
+        if tail_start < len(bad):
+            return first_tagged(start + tail_start, start + len(bad) - 1)
     return None
 
 
@@ -282,88 +248,16 @@ def resolve_section_base(symbol_addr: int, symbol_file_off: int, section: RelSec
     return symbol_addr - (symbol_file_off - section.offset)
 
 
-def read_cstring(data: bytes, offset: int) -> str:
-    end = data.find(b'\x00', offset)
-    if end == -1:
-        end = len(data)
-    return data[offset:end].decode('ascii', errors='ignore')
-
-
-def parse_bg_name_list(
-    data: bytes,
-    section: RelSection,
-    relocs: List[Relocation],
-    list_file_off: int,
-    base_addr: int,
-) -> List[Optional[str]]:
-    list_offset = list_file_off - section.offset
-    relocs_by_offset = {
-        r.patch_offset: r
-        for r in relocs
-        if r.patch_section == 5 and list_offset <= r.patch_offset < list_offset + BG_NAME_COUNT * 4
-    }
-    names: List[Optional[str]] = []
-    for idx in range(BG_NAME_COUNT):
-        entry_offset = list_offset + idx * 4
-        reloc = relocs_by_offset.get(entry_offset)
-        if not reloc:
-            ptr = read_u32_be(data, section.offset + entry_offset)
-            if ptr == 0:
-                names.append(None)
-                continue
-            if base_addr <= ptr < base_addr + section.size:
-                names.append((5, ptr - base_addr))
-            else:
-                names.append(None)
-            continue
-        target_section = reloc.target_section
-        if target_section <= 0:
-            names.append(None)
-            continue
-        if target_section < 0 or target_section >= 18:
-            names.append(None)
-            continue
-        # We only need section offsets; index lookup is fine.
-        # The caller has the full section list; we patch this later.
-        names.append((target_section, reloc.addend))
-    return names
-
-
-def resolve_bg_name_entries(
-    data: bytes,
-    sections: List[RelSection],
-    entries: List[Optional[Tuple[int, int]]],
-) -> List[Optional[str]]:
-    resolved: List[Optional[str]] = []
-    for entry in entries:
-        if not entry:
-            resolved.append(None)
-            continue
-        sec_idx, addend = entry
-        if sec_idx < 0 or sec_idx >= len(sections):
-            resolved.append(None)
-            continue
-        sec = sections[sec_idx]
-        if sec.offset == 0:
-            resolved.append(None)
-            continue
-        resolved.append(read_cstring(data, sec.offset + addend))
-    return resolved
-
-
 def parse_theme_lights(data: bytes, section: RelSection, base_addr: int, theme_addr: int) -> List[Dict[str, object]]:
     file_off = section.offset + (theme_addr - base_addr)
     lights = []
-    for i in range(THEME_LIGHT_COUNT):
-        off = file_off + i * 72
-        floats = struct.unpack_from('>16f', data, off)
-        rot_x = read_s16_be(data, off + 16 * 4)
-        rot_y = read_s16_be(data, off + 16 * 4 + 2)
+    # 72-byte records: 16 floats, rotX/rotY s16, 4 bytes unused.
+    for record in BinaryView.of(data).records('16f2h4x', file_off, THEME_LIGHT_COUNT):
         lights.append({
-            'ambient': [floats[1], floats[2], floats[3]],
-            'infLight': [floats[13], floats[14], floats[15]],
-            'rotX': rot_x,
-            'rotY': rot_y,
+            'ambient': [record[1], record[2], record[3]],
+            'infLight': [record[13], record[14], record[15]],
+            'rotX': record[16],
+            'rotY': record[17],
         })
     return lights
 
@@ -372,72 +266,96 @@ def parse_stage_world_themes_at(data: bytes, file_off: int) -> List[int]:
     return list(data[file_off:file_off + STAGE_WORLD_THEMES_LEN])
 
 
-def read_ptr_be(data: bytes, offset: int) -> Optional[int]:
-    if offset is None or offset < 0 or offset + 4 > len(data):
-        return None
-    value = read_u32_be(data, offset)
-    if value == 0 or value >= len(data):
+def parse_keyframe_columns(data: bytes, offset: Optional[int], count: int) -> Optional[KeyframeColumns]:
+    if offset is None or count <= 0:
         return None
-    return value
+    ease, t, v, in_tangent, out_tangent = BinaryView.of(data).columns('i4f', offset, count)
+    return {
+        'ease': [float(value) for value in ease],
+        't': list(t),
+        'v': list(v),
+        'in': list(in_tangent),
+        'out': list(out_tangent),
+    }
 
 
-def parse_keyframes(data: bytes, offset: Optional[int], count: int) -> Optional[List[Dict[str, float]]]:
-    if offset is None or count <= 0:
+def keyframe_columns_to_objects(columns: Optional[KeyframeColumns]) -> Optional[List[Dict[str, float]]]:
+    if columns is None:
         return None
-    frames = []
-    for i in range(count):
-        base = offset + i * KEYFRAME_SIZE
-        frames.append({
-            'ease': float(read_s32_be(data, base)),
-            't': read_f32_be(data, base + 4),
-            'v': read_f32_be(data, base + 8),
-            'in': read_f32_be(data, base + 0x0c),
-            'out': read_f32_be(data, base + 0x10),
-        })
-    return frames
+    return [dict(zip(KEYFRAME_FIELDS, values)) for values in zip(*(columns[key] for key in KEYFRAME_FIELDS))]
 
 
-def parse_stage_fog(data: bytes, fog_ptr: Optional[int], fog_anim_ptr: Optional[int]) -> Optional[StageFog]:
+def encode_keyframe_track(columns: Optional[KeyframeColumns], encoding: str) -> object:
+    """Return a keyframe track as stored in pack.json for `encoding`."""
+    if encoding == KEYFRAME_ENCODING_COLUMNAR:
+        return columns
+    return keyframe_columns_to_objects(columns)
+
+
+def parse_stage_fog(
+    data: bytes,
+    fog_ptr: Optional[int],
+    fog_anim_ptr: Optional[int],
+    size: Optional[int] = None,
+) -> Optional[StageFog]:
     if fog_ptr is None:
         return None
-    fog_type = read_u32_be(data, fog_ptr)
-    start = read_f32_be(data, fog_ptr + 4)
-    end = read_f32_be(data, fog_ptr + 8)
-    color = (
-        read_f32_be(data, fog_ptr + 0x0c),
-        read_f32_be(data, fog_ptr + 0x10),
-        read_f32_be(data, fog_ptr + 0x14),
-    )
+    view = BinaryView.of(data)
+    fog_type, start, end, red, green, blue = view.unpack('I5f', fog_ptr)
     anim = None
     if fog_anim_ptr is not None:
-        start_count = read_u32_be(data, fog_anim_ptr)
-        start_ptr = read_ptr_be(data, fog_anim_ptr + 4)
-        end_count = read_u32_be(data, fog_anim_ptr + 8)
-        end_ptr = read_ptr_be(data, fog_anim_ptr + 0x0c)
-        r_count = read_u32_be(data, fog_anim_ptr + 0x10)
-        r_ptr = read_ptr_be(data, fog_anim_ptr + 0x14)
-        g_count = read_u32_be(data, fog_anim_ptr + 0x18)
-        g_ptr = read_ptr_be(data, fog_anim_ptr + 0x1c)
-        b_count = read_u32_be(data, fog_anim_ptr + 0x20)
-        b_ptr = read_ptr_be(data, fog_anim_ptr + 0x24)
+        # Five (count, keyframe ptr) pairs: start, end, r, g, b.
+        (start_count, _, end_count, _, r_count, _, g_count, _, b_count) = view.unpack('9I', fog_anim_ptr)
         anim = FogAnim(
-            start=parse_keyframes(data, start_ptr, start_count),
-            end=parse_keyframes(data, end_ptr, end_count),
-            r=parse_keyframes(data, r_ptr, r_count),
-            g=parse_keyframes(data, g_ptr, g_count),
-            b=parse_keyframes(data, b_ptr, b_count),
+            start=parse_keyframe_columns(view, view.ptr(fog_anim_ptr + 4, size), start_count),
+            end=parse_keyframe_columns(view, view.ptr(fog_anim_ptr + 0x0c, size), end_count),
+            r=parse_keyframe_columns(view, view.ptr(fog_anim_ptr + 0x14, size), r_count),
+            g=parse_keyframe_columns(view, view.ptr(fog_anim_ptr + 0x1c, size), g_count),
+            b=parse_keyframe_columns(view, view.ptr(fog_anim_ptr + 0x24, size), b_count),
         )
-    return StageFog(fog_type=fog_type, start=start, end=end, color=color, anim=anim)
+    return StageFog(fog_type=fog_type, start=start, end=end, color=(red, green, blue), anim=anim)
 
 
-def parse_stage_env(stage_path: Path) -> Optional[StageFog]:
+def parse_stage_env(stage_path: Path, cache: Optional[DecompressedCache] = None) -> Optional[StageFog]:
     raw = stage_path.read_bytes()
-    decompressed = lzss_decompress(raw)
-    if not decompressed:
+    # A cached stagedef is already decompressed; read it directly.
+    decompressed = cache.lookup(raw) if cache is not None else None
+    if decompressed is not None:
+        try:
+            if not decompressed:
+                return None
+            with BinaryView(decompressed) as view:
+                return parse_stage_fog(view, view.ptr(0xbc), view.ptr(0xb0))
+        finally:
+            close_buffer(decompressed)
+    stream = LzssStream(raw)
+    fog = parse_stage_fog_stream(stream)
+    # The fog tables only need a prefix; finish decoding from there so the
+    # next build reads the whole stagedef from the cache.
+    if cache is not None and stream.size:
+        cache.store(raw, stream.read_all())
+    return fog
+
+
+def parse_stage_fog_stream(stream: LzssStream) -> Optional[StageFog]:
+    if not stream.size:
+        return None
+    header = BinaryView(stream.window(STAGEDEF_HEADER_SIZE))
+    fog_anim_ptr = header.ptr(0xb0, stream.size)
+    fog_ptr = header.ptr(0xbc, stream.size)
+    if fog_ptr is None:
         return None
-    fog_anim_ptr = read_ptr_be(decompressed, 0xb0)
-    fog_ptr = read_ptr_be(decompressed, 0xbc)
-    return parse_stage_fog(decompressed, fog_ptr, fog_anim_ptr)
+    # Only decode as far as the fog block, fog anim header and keyframe tables.
+    end = fog_ptr + STAGE_FOG_SIZE
+    if fog_anim_ptr is not None:
+        anim_header = BinaryView(stream.window(fog_anim_ptr + FOG_ANIM_HEADER_SIZE))
+        end = max(end, fog_anim_ptr + FOG_ANIM_HEADER_SIZE)
+        for track in range(5):
+            count = anim_header.u32(fog_anim_ptr + track * 8)
+            ptr = anim_header.ptr(fog_anim_ptr + track * 8 + 4, stream.size)
+            if ptr is not None and count > 0:
+                end = max(end, ptr + count * KEYFRAME_SIZE)
+    return parse_stage_fog(stream.window(end), fog_ptr, fog_anim_ptr, stream.size)
 
 
 def read_stage_names(stgname_path: Path) -> Dict[int, str]:
@@ -461,29 +379,304 @@ def list_stage_ids(stage_dir: Path) -> List[int]:
     return sorted(ids)
 
 
-def collect_stage_ids_from_courses(courses: Dict[str, object]) -> List[int]:
-    stage_ids: List[int] = []
+def collect_course_orders(courses: Dict[str, object]) -> List[List[int]]:
+    """Return the stage order of every challenge difficulty, then every story world."""
+    orders: List[List[int]] = []
     challenge = courses.get('challenge') if isinstance(courses, dict) else None
     if isinstance(challenge, dict):
         order = challenge.get('order')
         if isinstance(order, dict):
             for values in order.values():
                 if isinstance(values, list):
-                    stage_ids.extend([int(v) for v in values if isinstance(v, int)])
-    story = courses.get('story')
+                    orders.append([int(v) for v in values if isinstance(v, int)])
+    story = courses.get('story') if isinstance(courses, dict) else None
     if isinstance(story, list):
         for world in story:
             if isinstance(world, list):
-                stage_ids.extend([int(v) for v in world if isinstance(v, int)])
-    return stage_ids
+                orders.append([int(v) for v in world if isinstance(v, int)])
+    return orders
+
+
+def collect_stage_ids_from_courses(courses: Dict[str, object]) -> List[int]:
+    return [stage_id for order in collect_course_orders(courses) for stage_id in order]
+
 
+# File placement methods, in order of preference; each falls back to the next.
+LINK_MODES = ('reflink', 'hardlink', 'symlink', 'copy')
+FICLONE = 0x40049409  # Linux ioctl: share extents with another file (btrfs, XFS, ...)
 
-def copy_file(src: Path, dst: Path, warnings: List[str]) -> None:
+
+def reflink_file(src: Path, dst: Path) -> None:
+    try:
+        import fcntl
+    except ImportError as exc:
+        raise OSError(errno.EOPNOTSUPP, 'reflink not supported on this platform') from exc
+    try:
+        with src.open('rb') as src_file, dst.open('wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        dst.unlink(missing_ok=True)
+        raise
+
+
+def link_or_copy(src: Path, dst: Path, mode: str = 'copy', modes: Tuple[str, ...] = LINK_MODES) -> str:
+    """Place `src` at `dst` by `mode` or the next `modes` fallback; return the method used."""
+    # Never write through a link left by an earlier build into the ROM folder.
+    dst.unlink(missing_ok=True)
+    for method in modes[modes.index(mode):]:
+        try:
+            if method == 'reflink':
+                reflink_file(src, dst)
+            elif method == 'hardlink':
+                os.link(src, dst)
+            elif method == 'symlink':
+                os.symlink(src.resolve(), dst)
+            else:
+                shutil.copy2(src, dst)
+            return method
+        except OSError:
+            if method == 'copy':
+                raise
+    return 'copy'
+
+
+def copy_file(src: Path, dst: Path, warnings: List[str], link_mode: str = 'copy') -> None:
     if not src.exists():
         warnings.append(f'missing file: {src}')
         return
     dst.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copy2(src, dst)
+    link_or_copy(src, dst, link_mode)
+
+
+def recompress_lz_file(
+    src: Path,
+    dst: Path,
+    level: str,
+    warnings: List[str],
+    cache: Optional[DecompressedCache] = None,
+    link_mode: str = 'copy',
+) -> None:
+    """Copy an `.lz` file, re-encoding it at `level` when that makes it smaller."""
+    if not src.exists():
+        warnings.append(f'missing file: {src}')
+        return
+    packed = recompress_lz_data(src.read_bytes(), level, cache)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if packed is not None:
+        dst.unlink(missing_ok=True)
+        dst.write_bytes(packed)
+    else:
+        link_or_copy(src, dst, link_mode)
+
+
+def copy_lz_file(
+    src: Path,
+    dst: Path,
+    warnings: List[str],
+    lz_level: Optional[str] = None,
+    lz_cache: Optional[DecompressedCache] = None,
+    link_mode: str = 'copy',
+) -> None:
+    if lz_level:
+        recompress_lz_file(src, dst, lz_level, warnings, lz_cache, link_mode)
+    else:
+        copy_file(src, dst, warnings, link_mode)
+
+
+def build_stage_env(
+    stage_id: int,
+    stage_path: Path,
+    stage_world_themes: List[int],
+    bg_names: List[Optional[str]],
+    theme_lights: List[Dict[str, object]],
+    lz_cache: Optional[DecompressedCache] = None,
+    keyframe_encoding: str = KEYFRAME_ENCODING_OBJECTS,
+) -> Tuple[Dict[str, object], Optional[str]]:
+    """Return a stage's stageEnv entry and the background it references."""
+    env: Dict[str, object] = {}
+    referenced_bg = None
+    if stage_id < len(stage_world_themes):
+        theme_id = stage_world_themes[stage_id]
+        bg_name = bg_names[theme_id] if theme_id < len(bg_names) else None
+        if bg_name:
+            light = theme_lights[theme_id] if theme_id < len(theme_lights) else None
+            if light:
+                env['bgInfo'] = {
+                    'fileName': bg_name,
+                    'clearColor': [1.0, 1.0, 1.0, 1.0],
+                    'ambientColor': light['ambient'],
+                    'infLightColor': light['infLight'],
+                    'infLightRotX': light['rotX'],
+                    'infLightRotY': light['rotY'],
+                }
+            else:
+                env['bgInfo'] = {
+                    'fileName': bg_name,
+                    'clearColor': [1.0, 1.0, 1.0, 1.0],
+                }
+            referenced_bg = bg_name
+    fog = parse_stage_env(stage_path, lz_cache)
+    if fog:
+        fog_obj = {
+            'type': fog.fog_type,
+            'start': fog.start,
+            'end': fog.end,
+            'color': list(fog.color),
+        }
+        if fog.anim:
+            anim = {
+                'start': encode_keyframe_track(fog.anim.start, keyframe_encoding),
+                'end': encode_keyframe_track(fog.anim.end, keyframe_encoding),
+                'r': encode_keyframe_track(fog.anim.r, keyframe_encoding),
+                'g': encode_keyframe_track(fog.anim.g, keyframe_encoding),
+                'b': encode_keyframe_track(fog.anim.b, keyframe_encoding),
+            }
+            if any(anim.values()):
+                fog_obj['anim'] = anim
+        env['fog'] = fog_obj
+    return env, referenced_bg
+
+
+@dataclass
+class StageTask:
+    stage_id: int
+    stage_dir: Path
+    out_dir: Optional[Path]  # None: extract env only (files are streamed into a zip)
+    stage_world_themes: List[int]
+    bg_names: List[Optional[str]]
+    theme_lights: List[Dict[str, object]]
+    lz_level: Optional[str]
+    lz_cache: Optional[DecompressedCache]
+    keyframe_encoding: str = KEYFRAME_ENCODING_OBJECTS
+    link_mode: str = 'copy'
+    profile: bool = False
+
+
+@dataclass
+class StageResult:
+    stage_id: int
+    env: Dict[str, object]
+    bg_name: Optional[str]
+    warnings: List[str]
+    profile: Optional[Dict[str, object]] = None
+
+
+def process_stage(task: StageTask) -> StageResult:
+    started = (time.perf_counter(), time.process_time())
+    stage_id = task.stage_id
+    env, bg_name = build_stage_env(
+        stage_id,
+        task.stage_dir / f'STAGE{stage_id:03d}.lz',
+        task.stage_world_themes,
+        task.bg_names,
+        task.theme_lights,
+        task.lz_cache,
+        task.keyframe_encoding,
+    )
+    warnings: List[str] = []
+    sources = [task.stage_dir / f'STAGE{stage_id:03d}.lz']
+    if task.out_dir is not None:
+        stage_folder = task.out_dir / f'st{stage_id:03d}'
+        stage_folder.mkdir(exist_ok=True)
+        copy_lz_file(
+            sources[0],
+            stage_folder / f'STAGE{stage_id:03d}.lz',
+            warnings,
+            task.lz_level,
+            task.lz_cache,
+            task.link_mode,
+        )
+        for name in (f'st{stage_id:03d}.gma', f'st{stage_id:03d}.tpl'):
+            sources.append(task.stage_dir / name)
+            copy_file(sources[-1], stage_folder / name, warnings, task.link_mode)
+    profile = None
+    if task.profile:
+        profile = {
+            'stage': stage_id,
+            'wallSeconds': round(time.perf_counter() - started[0], 6),
+            'cpuSeconds': round(time.process_time() - started[1], 6),
+            'bytes': sum(path.stat().st_size for path in sources if path.exists()),
+            'peakRssBytes': peak_rss_bytes(),
+        }
+    return StageResult(stage_id=stage_id, env=env, bg_name=bg_name, warnings=warnings, profile=profile)
+
+
+def peak_rss_bytes(children: bool = False) -> Optional[int]:
+    """Peak resident set size so far of this process (or its largest reaped child)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # ru_maxrss is KiB except on macOS
+
+
+def cpu_seconds() -> float:
+    """CPU time of this process plus its reaped children (e.g. a finished process pool)."""
+    seconds = time.process_time()
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds += usage.ru_utime + usage.ru_stime
+    return seconds
+
+
+class BuildProfiler:
+    """Wall/CPU time, bytes processed and peak RSS per build phase (--profile)."""
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.phases: List[Dict[str, object]] = []
+        self.stages: List[Dict[str, object]] = []
+        self._started = (time.perf_counter(), cpu_seconds())
+        self._current: Optional[Dict[str, object]] = None
+        self._current_started = self._started
+
+    def phase(self, name: str) -> None:
+        if not self.enabled:
+            return
+        self.end_phase()
+        self._current = {'name': name, 'bytes': 0}
+        self._current_started = (time.perf_counter(), cpu_seconds())
+
+    def add_bytes(self, count: int) -> None:
+        if self._current is not None:
+            self._current['bytes'] += count
+
+    def add_stage(self, profile: Optional[Dict[str, object]]) -> None:
+        if self.enabled and profile:
+            self.stages.append(profile)
+
+    def end_phase(self) -> None:
+        if self._current is None:
+            return
+        wall, cpu = self._current_started
+        self._current['wallSeconds'] = round(time.perf_counter() - wall, 6)
+        self._current['cpuSeconds'] = round(cpu_seconds() - cpu, 6)
+        self._current['peakRssBytes'] = peak_rss_bytes()
+        self.phases.append(self._current)
+        self._current = None
+
+    def write(self, path: Path) -> None:
+        self.end_phase()
+        wall, cpu = self._started
+        report = {
+            'wallSeconds': round(time.perf_counter() - wall, 6),
+            'cpuSeconds': round(cpu_seconds() - cpu, 6),
+            'peakRssBytes': peak_rss_bytes(),
+            'peakWorkerRssBytes': peak_rss_bytes(children=True),
+            'phases': self.phases,
+            'stages': sorted(self.stages, key=lambda stage: stage['stage']),
+        }
+        path.write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+
+def run_stage_tasks(tasks: List[StageTask], jobs: int) -> List[StageResult]:
+    if jobs <= 1 or len(tasks) <= 1:
+        return [process_stage(task) for task in tasks]
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(jobs, len(tasks))
+    chunksize = max(1, len(tasks) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(process_stage, tasks, chunksize=chunksize))
 
 
 def find_lst_path(rom_dir: Path) -> Optional[Path]:
@@ -494,6 +687,240 @@ def find_lst_path(rom_dir: Path) -> Optional[Path]:
     return None
 
 
+# Section of the shared ROM cache (rom_cache.py) holding parsed main_loop.rel
+# tables; its key is the symbol file's hash, the entry is keyed by the REL's.
+ROM_ANALYSIS_SECTION = 'pack'
+
+
+@dataclass
+class RomAnalysis:
+    sections: List[RelSection]
+    stage_world_off: int
+    base_addr: int
+    stage_world_themes: List[int]
+    theme_lights: List[Dict[str, object]]
+
+
+def hash_inputs(*parts: Optional[bytes]) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        # Length-prefix each part so (a, bc) and (ab, c) differ; None marks a missing file.
+        digest.update(b'-' if part is None else len(part).to_bytes(8, 'little') + part)
+    return digest.hexdigest()
+
+
+def analyze_rom(rel_data: bytes, symbols: Dict[str, int]) -> RomAnalysis:
+    rel_header = parse_rel_header(rel_data)
+    sections = parse_rel_sections(rel_data, rel_header)
+
+    section5 = sections[5]
+    stage_world_off = DEFAULT_STAGE_WORLD_FILE_OFF
+    if not (section5.offset <= stage_world_off < section5.offset + section5.size):
+        stage_world_off = find_stage_world_themes_offset(rel_data, section5)
+    if stage_world_off is None:
+        raise SystemExit('failed to locate STAGE_WORLD_THEMES table')
+
+    stage_world_addr = symbols.get('STAGE_WORLD_THEMES')
+    theme_lights_addr = symbols.get('theme_lights')
+    if stage_world_addr is None or theme_lights_addr is None:
+        raise SystemExit('missing symbols in mkb2.us.lst (STAGE_WORLD_THEMES/theme_lights)')
+
+    base_addr = resolve_section_base(stage_world_addr, stage_world_off, section5)
+
+    return RomAnalysis(
+        sections=sections,
+        stage_world_off=stage_world_off,
+        base_addr=base_addr,
+        stage_world_themes=parse_stage_world_themes_at(rel_data, stage_world_off),
+        theme_lights=parse_theme_lights(rel_data, section5, base_addr, theme_lights_addr),
+    )
+
+
+def load_rom_analysis(main_loop_rel: Path, lst_path: Optional[Path], use_cache: bool = True) -> RomAnalysis:
+    rel_data = main_loop_rel.read_bytes()
+    lst_data = lst_path.read_bytes() if lst_path and lst_path.exists() else None
+    if lst_data is None:
+        print('Warning: mkb2.us.lst not found; using default symbol addresses.')
+    fingerprint = rel_fingerprint(rel_data)
+    key = hash_inputs(lst_data)
+    if use_cache:
+        cached = read_rom_entry(fingerprint, ROM_ANALYSIS_SECTION, key)
+        if isinstance(cached, dict):
+            try:
+                return RomAnalysis(
+                    sections=[RelSection(*section) for section in cached['sections']],
+                    stage_world_off=cached['stage_world_off'],
+                    base_addr=cached['base_addr'],
+                    stage_world_themes=cached['stage_world_themes'],
+                    theme_lights=cached['theme_lights'],
+                )
+            except (KeyError, TypeError):
+                pass
+
+    symbols = parse_symbol_addresses(lst_path) if lst_data is not None else DEFAULT_SYMBOLS.copy()
+    analysis = analyze_rom(rel_data, symbols)
+    if use_cache:
+        # The cache is best effort; a failed write only costs the next build a re-parse.
+        write_rom_entry(fingerprint, ROM_ANALYSIS_SECTION, {
+            'sections': [[section.offset, section.size, section.flags] for section in analysis.sections],
+            'stage_world_off': analysis.stage_world_off,
+            'base_addr': analysis.base_addr,
+            'stage_world_themes': analysis.stage_world_themes,
+            'theme_lights': analysis.theme_lights,
+        }, key)
+    return analysis
+
+
+def describe_pack_files(
+    out_dir: Path,
+    rel_paths: List[str],
+    sources: Dict[str, Path],
+    journal: BuildJournal,
+    lz_compressed: bool,
+) -> Dict[str, Dict[str, object]]:
+    """Build the manifest `files` section, reusing the hashes the journal already holds."""
+    hashed = [out_dir / rel_path for rel_path in rel_paths if rel_path not in sources]
+    files: Dict[str, Dict[str, object]] = {}
+    for rel_path in rel_paths:
+        path = out_dir / rel_path
+        state = journal.input_state(sources.get(rel_path, path))
+        with path.open('rb') as handle:
+            header = handle.read(LZSS_HEADER_SIZE)
+        files[rel_path] = describe_pack_file(
+            header, state['size'], state['sha256'], lz_compressed and rel_path.endswith('.lz'),
+        )
+    if journal.reuse('files', hashed) is None:
+        journal.record('files', hashed, [])
+    return files
+
+
+def plan_stage_bundles(orders: List[List[int]], run_length: int, stage_ids: Iterable[int]) -> List[List[int]]:
+    """Split each course order into runs of `run_length` pack stages, skipping repeated runs."""
+    available = set(stage_ids)
+    runs: List[List[int]] = []
+    seen = set()
+    for order in orders:
+        order = [stage_id for stage_id in order if stage_id in available]
+        for start in range(0, len(order), run_length):
+            run = order[start:start + run_length]
+            if tuple(run) not in seen:
+                seen.add(tuple(run))
+                runs.append(run)
+    return runs
+
+
+def write_stage_bundle(out_dir: Path, rel_path: str, members: List[str]) -> Dict[str, List[int]]:
+    """Concatenate pack files into `rel_path`; return {member: [offset, size]}."""
+    entries: Dict[str, List[int]] = {}
+    dst = out_dir / rel_path
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dst.with_name(f'{dst.name}.{os.getpid()}.tmp')
+    try:
+        with tmp_path.open('wb') as handle:
+            offset = 0
+            for member in members:
+                data = (out_dir / member).read_bytes()
+                handle.write(data)
+                entries[member] = [offset, len(data)]
+                offset += len(data)
+        os.replace(tmp_path, dst)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return entries
+
+
+# Blobs outlive the pack folder they came from, so they are never symlinks into it.
+BLOB_LINK_MODES = ('reflink', 'hardlink', 'copy')
+
+
+def store_blob(src: Path, store_dir: Path, digest: str) -> str:
+    """Add `src` to a content-addressed store as `<xx>/<sha256><suffix>`; return that path."""
+    rel_path = f'{digest[:2]}/{digest}{src.suffix}'
+    dst = store_dir / rel_path
+    if dst.exists():
+        return rel_path
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dst.with_name(f'{dst.name}.{os.getpid()}.tmp')
+    try:
+        link_or_copy(src, tmp_path, 'reflink', BLOB_LINK_MODES)
+        os.replace(tmp_path, dst)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    return rel_path
+
+
+def store_pack_blobs(out_dir: Path, store_dir: Path, journal: BuildJournal) -> Dict[str, object]:
+    """Add every file of the pack folder to `store_dir`; return the manifest's blobStore entry."""
+    rel_paths = sorted({rel_path for unit in journal.units.values() for rel_path in unit['outputs']})
+    paths = [out_dir / rel_path for rel_path in rel_paths]
+    data = journal.reuse('blobs', paths)
+    files = data.get('files') if data else None
+    if not isinstance(files, dict) or not all((store_dir / blob).exists() for blob in files.values()):
+        files = {
+            rel_path: store_blob(path, store_dir, journal.input_state(path)['sha256'])
+            for rel_path, path in zip(rel_paths, paths)
+        }
+        journal.record('blobs', paths, [], {'files': files})
+    base = os.path.relpath(store_dir.resolve(), out_dir.resolve())
+    return {'base': Path(base).as_posix(), 'files': files}
+
+
+# Precompressed sidecars (<file>.gz, <file>.br) for servers that can hand out
+# stored encodings, e.g. nginx gzip_static/brotli_static.
+PRECOMPRESS_SUFFIXES = ('.gma', '.tpl')
+SIDECAR_SUFFIXES = ('.gz', '.br')
+DEFAULT_PRECOMPRESS_RATIO = 0.9
+
+
+def precompress_data(data: bytes, ratio: float) -> Dict[str, bytes]:
+    """Return the .gz/.br encodings of `data` that are at most `ratio` times its size."""
+    encoded = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded['.br'] = brotli.compress(data, quality=11)
+    return {suffix: payload for suffix, payload in encoded.items() if len(payload) <= len(data) * ratio}
+
+
+def write_precompressed_sidecars(
+    out_dir: Path,
+    rel_paths: List[str],
+    journal: BuildJournal,
+    ratio: float,
+    workers: int,
+) -> Dict[str, Dict[str, int]]:
+    """Write sidecars for `rel_paths` next to them; return {path: {'gz'|'br': size}}."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    settings = {'ratio': ratio, 'brotli': brotli is not None}
+    sizes: Dict[str, Dict[str, int]] = {}
+    pending: List[str] = []
+    for rel_path in rel_paths:
+        data = journal.reuse(f'precompress/{rel_path}', [out_dir / rel_path])
+        if data is not None and data.get('settings') == settings:
+            sizes[rel_path] = data['sizes']
+        else:
+            pending.append(rel_path)
+
+    def compress(rel_path: str) -> Dict[str, bytes]:
+        return precompress_data((out_dir / rel_path).read_bytes(), ratio)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for rel_path, encoded in zip(pending, executor.map(compress, pending)):
+            outputs: List[Path] = []
+            for suffix, payload in encoded.items():
+                path = out_dir / f'{rel_path}{suffix}'
+                path.unlink(missing_ok=True)
+                path.write_bytes(payload)
+                outputs.append(path)
+            sizes[rel_path] = {suffix[1:]: len(payload) for suffix, payload in encoded.items()}
+            journal.record(
+                f'precompress/{rel_path}',
+                [out_dir / rel_path],
+                outputs,
+                {'settings': settings, 'sizes': sizes[rel_path]},
+            )
+    return {rel_path: sizes[rel_path] for rel_path in sorted(sizes) if sizes[rel_path]}
+
+
 def build_pack(
     rom_dir: Path,
     out_dir: Path,
@@ -504,7 +931,21 @@ def build_pack(
     courses_data: Optional[Dict[str, object]] = None,
     lst_path: Optional[Path] = None,
     stage_time_overrides: Optional[Dict[int, int]] = None,
+    lz_level: Optional[str] = None,
+    lz_cache: Optional[DecompressedCache] = None,
+    jobs: int = 1,
+    keyframe_encoding: str = KEYFRAME_ENCODING_OBJECTS,
+    analysis_cache: bool = True,
+    incremental: bool = True,
+    link_mode: str = 'copy',
+    zip_only: bool = False,
+    blob_store: Optional[Path] = None,
+    container_output: bool = False,
+    bundle_stages: int = 0,
+    precompress_ratio: Optional[float] = None,
+    profile_path: Optional[Path] = None,
 ) -> None:
+    profiler = BuildProfiler(enabled=profile_path is not None)
     main_loop_rel = rom_dir / 'mkb2.main_loop.rel'
     stgname = rom_dir / 'stgname' / 'usa.str'
     stage_dir = rom_dir / 'stage'
@@ -524,37 +965,20 @@ def build_pack(
         warnings.append(f'missing {bg_dir}')
     if not init_dir.exists():
         warnings.append(f'missing {init_dir}')
-    if lst_path and lst_path.exists():
-        symbols = parse_symbol_addresses(lst_path)
-    else:
-        symbols = DEFAULT_SYMBOLS.copy()
-        print('Warning: mkb2.us.lst not found; using default symbol addresses.')
-
-    rel_data = main_loop_rel.read_bytes()
-    rel_header = parse_rel_header(rel_data)
-    sections = parse_rel_sections(rel_data, rel_header)
-    relocs = parse_relocations(rel_data, rel_header)
-
-    section5 = sections[5]
-    stage_world_off = DEFAULT_STAGE_WORLD_FILE_OFF
-    if not (section5.offset <= stage_world_off < section5.offset + section5.size):
-        stage_world_off = find_stage_world_themes_offset(rel_data, section5)
-    if stage_world_off is None:
-        raise SystemExit('failed to locate STAGE_WORLD_THEMES table')
-
-    stage_world_addr = symbols.get('STAGE_WORLD_THEMES')
-    theme_lights_addr = symbols.get('theme_lights')
-    if stage_world_addr is None or theme_lights_addr is None:
-        raise SystemExit('missing symbols in mkb2.us.lst (STAGE_WORLD_THEMES/theme_lights)')
-
-    base_addr = resolve_section_base(stage_world_addr, stage_world_off, section5)
-
-    stage_world_themes = parse_stage_world_themes_at(rel_data, stage_world_off)
+    if blob_store is not None and (zip_output or zip_only or container_output):
+        raise SystemExit('a pack using a blob store cannot be zipped or packed into a container')
+    if bundle_stages > 0 and zip_only:
+        raise SystemExit('stage bundles need a pack folder (not zip_only)')
+    if precompress_ratio is not None and (zip_only or blob_store is not None):
+        raise SystemExit('precompressed sidecars need a pack folder without a blob store')
+    profiler.phase('analysis')
+    profiler.add_bytes(main_loop_rel.stat().st_size)
+    analysis = load_rom_analysis(main_loop_rel, lst_path, use_cache=analysis_cache)
+    stage_world_themes = analysis.stage_world_themes
+    theme_lights = analysis.theme_lights
 
     bg_names = BG_NAME_TABLE
 
-    theme_lights = parse_theme_lights(rel_data, section5, base_addr, theme_lights_addr)
-
     stage_ids = list_stage_ids(stage_dir)
     stage_names = read_stage_names(stgname)
 
@@ -574,52 +998,82 @@ def build_pack(
             stage_ids = sorted({sid for sid in requested if sid in available})
             stage_names = {k: v for k, v in stage_names.items() if k in stage_ids}
 
+    # With zip_only, ROM files and pack.json go straight into <out>.zip in this
+    # order and no pack folder (or build journal) is written.
+    zip_members: List[ZipMember] = []
+    journal: Optional[BuildJournal] = None
+    if not zip_only:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        (out_dir / 'init').mkdir(exist_ok=True)
+        (out_dir / 'bg').mkdir(exist_ok=True)
+        journal = BuildJournal(out_dir, {
+            'lz_level': lz_level,
+            'keyframe_encoding': keyframe_encoding,
+            'link_mode': link_mode,
+            'analysis': hash_inputs(json.dumps([stage_world_themes, bg_names, theme_lights]).encode('utf-8')),
+        }, reuse=incremental)
+
+    def stage_files(folder: Path, stage_id: int) -> List[Path]:
+        return [
+            folder / f'STAGE{stage_id:03d}.lz',
+            folder / f'st{stage_id:03d}.gma',
+            folder / f'st{stage_id:03d}.tpl',
+        ]
+
+    # Extract stage env and place stage files, optionally across a process pool.
+    # Stages whose inputs and outputs are unchanged since the last build are
+    # carried over from the journal; results are merged in stage order, so the
+    # stageEnv is deterministic.
+    profiler.phase('stages')
+    results: Dict[int, StageResult] = {}
+    tasks: List[StageTask] = []
+    for stage_id in stage_ids:
+        data = journal.reuse(f'st{stage_id:03d}', stage_files(stage_dir, stage_id)) if journal else None
+        if data is not None:
+            results[stage_id] = StageResult(
+                stage_id=stage_id,
+                env=data['env'],
+                bg_name=data['bg_name'],
+                warnings=data['warnings'],
+            )
+            profiler.add_stage({'stage': stage_id, 'reused': True})
+            continue
+        tasks.append(StageTask(
+            stage_id=stage_id,
+            stage_dir=stage_dir,
+            out_dir=None if zip_only else out_dir,
+            stage_world_themes=stage_world_themes,
+            bg_names=bg_names,
+            theme_lights=theme_lights,
+            lz_level=lz_level,
+            lz_cache=lz_cache,
+            keyframe_encoding=keyframe_encoding,
+            link_mode=link_mode,
+            profile=profiler.enabled,
+        ))
+    for result in run_stage_tasks(tasks, jobs):
+        profiler.add_stage(result.profile)
+        if result.profile:
+            profiler.add_bytes(result.profile['bytes'])
+        if journal:
+            journal.record(
+                f'st{result.stage_id:03d}',
+                stage_files(stage_dir, result.stage_id),
+                stage_files(out_dir / f'st{result.stage_id:03d}', result.stage_id),
+                {'env': result.env, 'bg_name': result.bg_name, 'warnings': result.warnings},
+            )
+        results[result.stage_id] = result
+
     stage_env: Dict[str, Dict[str, object]] = {}
     referenced_bgs = set()
-
+    stage_warnings: List[str] = []
     for stage_id in stage_ids:
-        env: Dict[str, object] = {}
-        if stage_id < len(stage_world_themes):
-            theme_id = stage_world_themes[stage_id]
-            bg_name = bg_names[theme_id] if theme_id < len(bg_names) else None
-            if bg_name:
-                light = theme_lights[theme_id] if theme_id < len(theme_lights) else None
-                if light:
-                    env['bgInfo'] = {
-                        'fileName': bg_name,
-                        'clearColor': [1.0, 1.0, 1.0, 1.0],
-                        'ambientColor': light['ambient'],
-                        'infLightColor': light['infLight'],
-                        'infLightRotX': light['rotX'],
-                        'infLightRotY': light['rotY'],
-                    }
-                else:
-                    env['bgInfo'] = {
-                        'fileName': bg_name,
-                        'clearColor': [1.0, 1.0, 1.0, 1.0],
-                    }
-                referenced_bgs.add(bg_name)
-        fog = parse_stage_env(stage_dir / f'STAGE{stage_id:03d}.lz')
-        if fog:
-            fog_obj = {
-                'type': fog.fog_type,
-                'start': fog.start,
-                'end': fog.end,
-                'color': list(fog.color),
-            }
-            if fog.anim:
-                anim = {
-                    'start': fog.anim.start,
-                    'end': fog.anim.end,
-                    'r': fog.anim.r,
-                    'g': fog.anim.g,
-                    'b': fog.anim.b,
-                }
-                if any(anim.values()):
-                    fog_obj['anim'] = anim
-            env['fog'] = fog_obj
-        if env:
-            stage_env[str(stage_id)] = env
+        result = results[stage_id]
+        if result.env:
+            stage_env[str(result.stage_id)] = result.env
+        if result.bg_name:
+            referenced_bgs.add(result.bg_name)
+        stage_warnings.extend(result.warnings)
 
     if not referenced_bgs:
         warnings.append('no backgrounds referenced from stage env data')
@@ -640,41 +1094,204 @@ def build_pack(
         'courses': courses,
         'stageEnv': stage_env,
     }
-
-    out_dir.mkdir(parents=True, exist_ok=True)
-    (out_dir / 'init').mkdir(exist_ok=True)
-    (out_dir / 'bg').mkdir(exist_ok=True)
+    if keyframe_encoding == KEYFRAME_ENCODING_COLUMNAR:
+        pack_manifest['keyframeEncoding'] = KEYFRAME_ENCODING_COLUMNAR
+    if lz_level == LZ_LEVEL_DECOMPRESSED:
+        pack_manifest['lzDecompressed'] = True
+
+    # Pack files that are unchanged copies of a ROM file, by pack path.
+    sources: Dict[str, Path] = {}
+
+    def place_file(src: Path, rel_path: str, file_warnings: Optional[List[str]] = None) -> None:
+        if not (lz_level and src.suffix == '.lz'):
+            sources[rel_path] = src
+        target_warnings = warnings if file_warnings is None else file_warnings
+        if journal is None:
+            if not src.exists():
+                target_warnings.append(f'missing file: {src}')
+                return
+            level = lz_level if src.suffix == '.lz' else None
+            zip_members.append(ZipMember(
+                rel_path, path=src, lz_level=level, lz_cache=lz_cache,
+                deflate=True if level == LZ_LEVEL_DECOMPRESSED else None,
+            ))
+            return
+        dst = out_dir / rel_path
+        data = journal.reuse(rel_path, [src])
+        if data is not None:
+            target_warnings.extend(data.get('warnings', []))
+            return
+        unit_warnings: List[str] = []
+        if src.suffix == '.lz':
+            copy_lz_file(src, dst, unit_warnings, lz_level, lz_cache, link_mode)
+        else:
+            copy_file(src, dst, unit_warnings, link_mode)
+        if src.exists():
+            profiler.add_bytes(src.stat().st_size)
+        target_warnings.extend(unit_warnings)
+        journal.record(rel_path, [src], [dst], {'warnings': unit_warnings})
 
     # Copy init
-    copy_file(init_dir / 'common.lz', out_dir / 'init' / 'common.lz', warnings)
-    copy_file(init_dir / 'common_p.lz', out_dir / 'init' / 'common_p.lz', warnings)
-    copy_file(init_dir / 'common.gma', out_dir / 'init' / 'common.gma', warnings)
-    copy_file(init_dir / 'common.tpl', out_dir / 'init' / 'common.tpl', warnings)
+    profiler.phase('files')
+    for name in ('common.lz', 'common_p.lz', 'common.gma', 'common.tpl'):
+        place_file(init_dir / name, f'init/{name}')
 
-    # Copy stages
+    # Stage files were placed alongside env extraction, unless streaming to the zip.
     for stage_id in stage_ids:
-        stage_folder = out_dir / f'st{stage_id:03d}'
-        stage_folder.mkdir(exist_ok=True)
-        copy_file(stage_dir / f'STAGE{stage_id:03d}.lz', stage_folder / f'STAGE{stage_id:03d}.lz', warnings)
-        copy_file(stage_dir / f'st{stage_id:03d}.gma', stage_folder / f'st{stage_id:03d}.gma', warnings)
-        copy_file(stage_dir / f'st{stage_id:03d}.tpl', stage_folder / f'st{stage_id:03d}.tpl', warnings)
+        folder = f'st{stage_id:03d}'
+        for src in stage_files(stage_dir, stage_id):
+            if zip_only:
+                place_file(src, f'{folder}/{src.name}', stage_warnings)
+            elif not (lz_level and src.suffix == '.lz'):
+                sources[f'{folder}/{src.name}'] = src
+    warnings.extend(stage_warnings)
 
     # Copy backgrounds
     for bg_name in sorted(referenced_bgs):
-        copy_file(bg_dir / f'{bg_name}.gma', out_dir / 'bg' / f'{bg_name}.gma', warnings)
-        copy_file(bg_dir / f'{bg_name}.tpl', out_dir / 'bg' / f'{bg_name}.tpl', warnings)
-
-    # Write pack.json
-    (out_dir / 'pack.json').write_text(json.dumps(pack_manifest, indent=2), encoding='utf-8')
+        place_file(bg_dir / f'{bg_name}.gma', f'bg/{bg_name}.gma')
+        place_file(bg_dir / f'{bg_name}.tpl', f'bg/{bg_name}.tpl')
+
+    # Bundle the files of each run of consecutive course stages (plus their
+    # backgrounds), so one request can warm the next few stages.
+    if bundle_stages > 0:
+        profiler.phase('bundles')
+        orders = collect_course_orders(courses or {})
+        if not orders:
+            warnings.append('no course orders to bundle stages by')
+        bundles: List[Dict[str, object]] = []
+        for run in plan_stage_bundles(orders, bundle_stages, stage_ids):
+            members: List[str] = []
+            for stage_id in run:
+                members.extend(f'st{stage_id:03d}/{path.name}' for path in stage_files(stage_dir, stage_id))
+                bg_name = results[stage_id].bg_name
+                if bg_name:
+                    members.extend((f'bg/{bg_name}.gma', f'bg/{bg_name}.tpl'))
+            members = [member for member in dict.fromkeys(members) if (out_dir / member).exists()]
+            rel_path = f'bundles/{hash_inputs(*(member.encode("utf-8") for member in members))[:16]}.bin'
+            if any(bundle['path'] == rel_path for bundle in bundles):
+                continue
+            inputs = [out_dir / member for member in members]
+            data = journal.reuse(rel_path, inputs)
+            if data is None:
+                data = {'files': write_stage_bundle(out_dir, rel_path, members)}
+                journal.record(rel_path, inputs, [out_dir / rel_path], data)
+                profiler.add_bytes(sum(size for _offset, size in data['files'].values()))
+            bundles.append({'path': rel_path, 'stages': run, 'files': data['files']})
+        if bundles:
+            pack_manifest['bundles'] = bundles
+
+    # Sidecars sit next to their files; the manifest records which exist.
+    if precompress_ratio is not None:
+        profiler.phase('precompress')
+        suffixes = PRECOMPRESS_SUFFIXES + (('.lz',) if lz_level == LZ_LEVEL_DECOMPRESSED else ())
+        rel_paths = sorted({
+            rel_path for unit in journal.units.values() for rel_path in unit['outputs']
+            if rel_path.endswith(suffixes)
+        })
+        profiler.add_bytes(sum((out_dir / rel_path).stat().st_size for rel_path in rel_paths))
+        precompressed = write_precompressed_sidecars(
+            out_dir, rel_paths, journal, precompress_ratio, os.cpu_count() or 1,
+        )
+        if precompressed:
+            pack_manifest['precompressed'] = precompressed
+
+    # Sizes and hashes of everything the client can fetch (sidecars are just
+    # transport encodings of these). With zip_only they are taken from the
+    # data as it is zipped, and pack.json goes last.
+    if journal is not None:
+        profiler.phase('hashes')
+        rel_paths = sorted({
+            rel_path for unit in journal.units.values() for rel_path in unit['outputs']
+            if not rel_path.endswith(SIDECAR_SUFFIXES)
+        })
+        pack_manifest['files'] = describe_pack_files(
+            out_dir, rel_paths, sources, journal, lz_level != LZ_LEVEL_DECOMPRESSED,
+        )
 
-    if zip_output:
-        zip_path = out_dir.with_suffix('.zip')
-        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-            for root, _, files in os.walk(out_dir):
-                for name in files:
-                    file_path = Path(root) / name
-                    rel_path = file_path.relative_to(out_dir)
-                    zf.write(file_path, rel_path.as_posix())
+    # Point URL clients at the shared store. The pack folder is not
+    # deduplicated: its files stay as the build's working copy (reflinked into
+    # the store when the filesystem allows) and serve local folder loads.
+    if blob_store is not None:
+        profiler.phase('blobs')
+        pack_manifest['blobStore'] = store_pack_blobs(out_dir, blob_store, journal)
+
+    profiler.phase('manifest')
+    manifest_text = json.dumps(pack_manifest, indent=2)
+    zip_path = out_dir.with_suffix('.zip')
+    container_path = out_dir.with_suffix(PACK_CONTAINER_SUFFIX)
+    if journal is None:
+        manifest_member = ZipMember('pack.json')
+
+        def manifest_trailer(files: Dict[str, Dict[str, object]]) -> ZipMember:
+            pack_manifest['files'] = files
+            manifest_member.data = json.dumps(pack_manifest, indent=2).encode('utf-8')
+            return manifest_member
+
+        # Members are encoded once for both archives. The container's index
+        # still lists pack.json first, though its data comes last here.
+        profiler.phase('zip')
+        if container_output:
+            names = [manifest_member.name] + [member.name for member in zip_members]
+            with PackContainerWriter(container_path, names) as container:
+                write_pack_zip(zip_path, zip_members, os.cpu_count() or 1, manifest_trailer, container)
+            profiler.add_bytes(container_path.stat().st_size)
+        else:
+            write_pack_zip(zip_path, zip_members, os.cpu_count() or 1, manifest_trailer)
+        profiler.add_bytes(zip_path.stat().st_size)
+    else:
+        # Write pack.json (left untouched when identical, like the other outputs)
+        manifest_path = out_dir / 'pack.json'
+        try:
+            manifest_current = manifest_path.read_text(encoding='utf-8') == manifest_text
+        except OSError:
+            manifest_current = False
+        if not manifest_current:
+            manifest_path.write_text(manifest_text, encoding='utf-8')
+            journal.changed = True
+            profiler.add_bytes(len(manifest_text))
+        if precompress_ratio is not None:
+            write_precompressed_sidecars(out_dir, ['pack.json'], journal, precompress_ratio, 1)
+
+        # Drop outputs of stages/bgs no longer in the pack, then save the journal.
+        journal.finish()
+
+        # pack.json leads, so a container's manifest sits right after its index.
+        # Zips and containers already read members individually, so bundles
+        # would only store every stage twice; their pack.json leaves them out.
+        folder_files = sorted(
+            (
+                path for path in out_dir.rglob('*')
+                if path.is_file() and path.name != BUILD_JOURNAL_NAME and path.suffix not in SIDECAR_SUFFIXES
+                and path.relative_to(out_dir).parts[0] != 'bundles'
+            ),
+            key=lambda path: (path != manifest_path, path),
+        )
+        folder_members = [
+            ZipMember(
+                path.relative_to(out_dir).as_posix(), path=path,
+                deflate=True if lz_level == LZ_LEVEL_DECOMPRESSED and path.suffix == '.lz' else None,
+            )
+            for path in folder_files
+        ]
+        if 'bundles' in pack_manifest:
+            archive_manifest = {key: value for key, value in pack_manifest.items() if key != 'bundles'}
+            archive_manifest['files'] = {
+                rel_path: info for rel_path, info in pack_manifest.get('files', {}).items()
+                if not rel_path.startswith('bundles/')
+            }
+            folder_members[0] = ZipMember('pack.json', data=json.dumps(archive_manifest, indent=2).encode('utf-8'))
+        if zip_output and (journal.changed or not zip_path.exists()):
+            profiler.phase('zip')
+            write_pack_zip(zip_path, folder_members, os.cpu_count() or 1)
+            profiler.add_bytes(zip_path.stat().st_size)
+        if container_output and (journal.changed or not container_path.exists()):
+            profiler.phase('container')
+            write_pack_container(container_path, folder_members, os.cpu_count() or 1)
+            profiler.add_bytes(container_path.stat().st_size)
+
+    if profile_path is not None:
+        profiler.write(profile_path)
+        print(f'Build profile written to {profile_path}')
 
     if warnings:
         print('Warnings:')
@@ -684,13 +1301,15 @@ def build_pack(
 
 def load_vanilla_courses_from_rom(
     rom_dir: Path,
+    use_cache: bool = True,
 ) -> Tuple[Dict[str, List[Tuple[int, bool]]], List[List[int]], Dict[int, int], List[str]]:
     try:
         from dump_vanilla_conf import load_vanilla_course_data
     except Exception as exc:
         raise RuntimeError(f'failed to import dump_vanilla_conf: {exc}') from exc
 
-    data = load_vanilla_course_data(rom_dir)
+    # Table offsets are cached per REL in the shared ROM cache by dump_vanilla_conf.
+    data = load_vanilla_course_data(rom_dir, use_registry=use_cache)
     challenge = data.get('challenge') if isinstance(data, dict) else None
     story = data.get('story') if isinstance(data, dict) else None
 
@@ -873,6 +1492,102 @@ def main() -> None:
     parser.add_argument('--courses', type=Path, help='Optional JSON file defining course lists')
     parser.add_argument('--lst', type=Path, help='Path to mkb2.us.lst (optional)')
     parser.add_argument('--zip', action='store_true', help='Also emit pack.zip')
+    parser.add_argument(
+        '--zip-only',
+        action='store_true',
+        help='Stream files straight into <out>.zip without writing the pack folder',
+    )
+    parser.add_argument(
+        '--container',
+        action='store_true',
+        help=f'Also emit <out>{PACK_CONTAINER_SUFFIX}, a single file clients can read with HTTP Range requests',
+    )
+    parser.add_argument(
+        '--bundle-stages',
+        type=int,
+        default=0,
+        metavar='N',
+        help='Also write bundles of the files of every N consecutive stages of each course, for prefetching',
+    )
+    parser.add_argument(
+        '--precompress',
+        action='store_true',
+        help='Write max-effort .gz (and .br, if brotli is installed) sidecars for pack.json, .gma and .tpl files',
+    )
+    parser.add_argument(
+        '--precompress-ratio',
+        type=float,
+        default=DEFAULT_PRECOMPRESS_RATIO,
+        help='Keep a sidecar only when it is at most this fraction of the original size',
+    )
+    parser.add_argument(
+        '--lz-level',
+        choices=sorted(LZSS_LEVELS),
+        help='Re-encode .lz files at this compression level when it makes them smaller',
+    )
+    parser.add_argument(
+        '--decompress-lz',
+        action='store_true',
+        help='Store .lz files (stagedefs, NL objects) decompressed so clients skip LZSS',
+    )
+    parser.add_argument(
+        '--lz-cache',
+        type=Path,
+        default=default_lz_cache_dir(),
+        help='Directory caching decompressed .lz files across builds',
+    )
+    parser.add_argument(
+        '--lz-cache-mb',
+        type=int,
+        default=DEFAULT_LZ_CACHE_MAX_BYTES // (1024 * 1024),
+        help='Size limit of the .lz cache in MiB (least recently used entries are evicted)',
+    )
+    parser.add_argument('--no-lz-cache', action='store_true', help='Do not cache decompressed .lz files')
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help='Worker processes for stage env extraction and file placement (0 = CPU count)',
+    )
+    parser.add_argument(
+        '--columnar-keyframes',
+        action='store_true',
+        help='Store fog anim keyframes as parallel t/v/in/out/ease arrays in pack.json',
+    )
+    parser.add_argument(
+        '--no-analysis-cache',
+        action='store_true',
+        help='Do not read or write the shared ROM cache under the cache directory',
+    )
+    parser.add_argument(
+        '--link-mode',
+        choices=LINK_MODES,
+        default='copy',
+        help='How to place unmodified ROM files in the pack; falls back in the order '
+             f'{", ".join(LINK_MODES)} when a method is unavailable',
+    )
+    parser.add_argument(
+        '--full-rebuild',
+        action='store_true',
+        help=f'Ignore {BUILD_JOURNAL_NAME} in the output folder and rebuild every file',
+    )
+    parser.add_argument(
+        '--blob-store',
+        type=Path,
+        help='Content-addressed store (shareable by several packs) that pack.json maps files into; '
+        'the pack folder keeps its own full copies',
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Write per-phase and per-stage wall/CPU time, bytes and peak RSS to <out>.profile.json',
+    )
+    parser.add_argument(
+        '--cprofile',
+        action='store_true',
+        help='Also run the build under cProfile, dump <out>.pstats and print the hottest functions '
+             '(main process only; --jobs workers are not covered)',
+    )
     parser.add_argument('--gui', action='store_true', help='Launch a simple GUI')
     args = parser.parse_args()
 
@@ -881,7 +1596,52 @@ def main() -> None:
         return
     if not args.rom or not args.out or not args.id or not args.name:
         parser.error('--rom, --out, --id, and --name are required unless --gui is used')
-    build_pack(args.rom, args.out, args.id, args.name, args.courses, args.zip, lst_path=args.lst)
+    if args.bundle_stages > 0 and args.zip_only:
+        parser.error('--bundle-stages needs a pack folder and cannot be combined with --zip-only')
+    if args.decompress_lz and args.lz_level:
+        parser.error('--decompress-lz cannot be combined with --lz-level')
+    if args.precompress and (args.zip_only or args.blob_store):
+        parser.error('--precompress cannot be combined with --zip-only or --blob-store')
+    if args.precompress_ratio <= 0:
+        parser.error('--precompress-ratio must be positive')
+    if args.blob_store and (args.zip or args.zip_only or args.container):
+        parser.error('--blob-store cannot be combined with --zip, --zip-only or --container')
+    profiler = None
+    if args.cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    build_pack(
+        args.rom,
+        args.out,
+        args.id,
+        args.name,
+        args.courses,
+        args.zip,
+        lst_path=args.lst,
+        lz_level=LZ_LEVEL_DECOMPRESSED if args.decompress_lz else args.lz_level,
+        lz_cache=None if args.no_lz_cache else DecompressedCache(args.lz_cache, args.lz_cache_mb * 1024 * 1024),
+        jobs=args.jobs if args.jobs > 0 else (os.cpu_count() or 1),
+        keyframe_encoding=KEYFRAME_ENCODING_COLUMNAR if args.columnar_keyframes else KEYFRAME_ENCODING_OBJECTS,
+        analysis_cache=not args.no_analysis_cache,
+        incremental=not args.full_rebuild,
+        link_mode=args.link_mode,
+        zip_only=args.zip_only,
+        blob_store=args.blob_store,
+        container_output=args.container,
+        bundle_stages=args.bundle_stages,
+        precompress_ratio=args.precompress_ratio if args.precompress else None,
+        profile_path=args.out.with_name(f'{args.out.stem}.profile.json') if args.profile else None,
+    )
+    if profiler is not None:
+        import pstats
+
+        profiler.disable()
+        pstats_path = args.out.with_name(f'{args.out.stem}.pstats')
+        profiler.dump_stats(pstats_path)
+        print(f'cProfile stats written to {pstats_path}')
+        pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(25)
 
 
 def run_gui() -> None:
@@ -1309,6 +2069,7 @@ def run_gui() -> None:
                 courses_data=courses_data,
                 lst_path=Path(lst_var.get().strip()) if lst_var.get().strip() else None,
                 stage_time_overrides=stage_time_overrides,
+                lz_cache=DecompressedCache(default_lz_cache_dir()),
             )
         except Exception as exc:
             messagebox.showerror('Build failed', str(exc))